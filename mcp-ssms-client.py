@@ -1,4 +1,5 @@
 import asyncio
+import hashlib
 import os
 import re
 import json
@@ -19,12 +20,22 @@ TABLE_SCHEMA = os.getenv("MSSQL_TABLE_SCHEMA", "dbo")
 TABLE_NAME = os.getenv("MSSQL_TABLE_NAME", "your_table_name")
 FULLY_QUALIFIED_TABLE_NAME = f"{TABLE_SCHEMA}.{TABLE_NAME}" if TABLE_SCHEMA else TABLE_NAME
 
+# Seconds an idle HTTPS connection to Azure OpenAI is kept for reuse. httpx's
+# default of 5s is shorter than the time spent reviewing SQL between calls,
+# so nearly every completion would pay a new TLS handshake.
+AZURE_OPENAI_KEEPALIVE_SECONDS = float(os.getenv("AZURE_OPENAI_KEEPALIVE_SECONDS", "120"))
+
 # Using Azure OpenAI only
+import httpx
 from openai import AzureOpenAI
 client = AzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
     api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=AZURE_OPENAI_KEEPALIVE_SECONDS),
+        follow_redirects=True,
+    ),
 )
 
 # Create server parameters for stdio connection
@@ -34,6 +45,92 @@ server_params = StdioServerParameters(
     env=None,                  # Optional environment variables
 )
 
+# Operators and functions that mark a calculation query, matched in one scan
+# (same pattern the server uses when logging)
+_CALC_RE = re.compile(r' / |[*+-]|(?:AVG|SUM|COUNT|CAST|CONVERT)\(', re.IGNORECASE)
+
+# Row count in query_table's success message
+_ROWS_RETURNED_RE = re.compile(r"(\d+) rows returned")
+
+# Row count in query_table's message for INSERT/UPDATE/DELETE statements
+_ROWS_AFFECTED_RE = re.compile(r"SQL executed successfully\. (-?\d+) rows affected\.")
+
+# Comments and string literals, and innermost parenthesized groups, removed to
+# find a statement's main verb past leading comments and CTE definitions
+_SQL_TRIVIA_RE = re.compile(r"--[^\n]*|/\*.*?(?:\*/|\Z)|N?'(?:[^']|'')*(?:'|\Z)", re.DOTALL)
+_SQL_GROUP_RE = re.compile(r"\([^()]*\)")
+_SQL_VERB_RE = re.compile(r"\b(SELECT|INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+# Patterns for pulling SQL out of a model reply, compiled once at import
+_TOOL_CALL_RE = re.compile(r"TOOL:\s*(\w+),\s*ARGS:\s*(\{.*\})")
+_SQL_ARG_RE = re.compile(r'"sql":\s*"(.+?)"')
+# Also accepts the ```tsql and ```t-sql fences models often emit for SQL Server
+_SQL_CODE_BLOCK_RE = re.compile(r'```(?:sql|tsql|t-sql)\s*(.*?)\s*```', re.DOTALL | re.IGNORECASE)
+_SELECT_RE = re.compile(r'\bSELECT\b', re.IGNORECASE)
+_FROM_RE = re.compile(r'\bFROM\b', re.IGNORECASE)
+_SQL_LINE_RE = re.compile(r'\b(SELECT|FROM|WHERE|ORDER BY|GROUP BY|HAVING|JOIN)\b', re.IGNORECASE)
+
+# Collapses runs of whitespace when normalizing prompts for the response cache
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(text: str) -> str:
+    """Collapse whitespace and trailing punctuation so trivially different prompts share a cache entry.
+    
+    Case is kept: values quoted in the question end up as literals in the SQL.
+    """
+    return _WHITESPACE_RE.sub(" ", text).strip().rstrip("?.!; ")
+
+def completion_cache_key(kind: str, messages: List[Dict[str, str]]) -> str:
+    """SHA-256 key over the exact chat messages, for caching low-temperature completions."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message["role"].encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(message["content"].encode("utf-8"))
+        digest.update(b"\x00")
+    return f"{kind}:{digest.hexdigest()}"
+
+def statement_verb(sql: str) -> str:
+    """Return the main DML verb of a statement (e.g. "UPDATE" for WITH ... UPDATE), or "SQL"."""
+    text = _SQL_TRIVIA_RE.sub(" ", sql)
+    # CTE bodies and subqueries are parenthesized, so strip groups from the inside out
+    while True:
+        text, count = _SQL_GROUP_RE.subn(" ", text)
+        if not count:
+            break
+    verb = _SQL_VERB_RE.search(text)
+    return verb.group(1).upper() if verb else "SQL"
+
+def canned_explanation(sql: str, results: str) -> Optional[str]:
+    """Explain results that need no model call: no rows, DML row counts, or a single value.
+    
+    Returns None when the results should be explained by the model.
+    """
+    if results.startswith("Query executed successfully, but no rows were returned."):
+        return "The query returned no rows, so no records in the table match these conditions."
+    
+    statement = statement_verb(sql)
+    affected = _ROWS_AFFECTED_RE.search(results)
+    if affected:
+        return f"The {statement} statement affected {affected.group(1)} row(s) in {FULLY_QUALIFIED_TABLE_NAME}."
+    if results.startswith("SQL executed successfully"):
+        return f"The {statement} statement completed successfully."
+    
+    # A single row with a single column (e.g. a COUNT or SUM) is its own explanation
+    _, _, json_str = results.partition("\n\nJSON_DATA:")
+    if json_str and len(json_str) < 1000:
+        try:
+            data = json.loads(json_str)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(data, dict):
+            if len(data.get("columns", [])) == 1 and len(data.get("rows", [])) == 1:
+                return f"The query returned a single value: {data['columns'][0] or 'result'} = {data['rows'][0][0]}."
+        elif len(data) == 1 and len(data[0]) == 1:
+            (column, value), = data[0].items()
+            return f"The query returned a single value: {column or 'result'} = {value}."
+    return None
+
 if os.name == 'nt':
     import msvcrt
 
@@ -77,19 +174,19 @@ class Chat:
     query_history: List[Dict[str, Any]] = field(default_factory=list)
     response_cache: Dict[str, Any] = field(default_factory=dict)  # Cache for model responses
     
-    # Minimal system prompt for initial schema retrieval
+    # Minimal system prompt for initial schema retrieval; the table is fixed, so it is rendered once here
     schema_system_prompt: str = (
-        "You are an assistant that creates SQL queries for table {table_name}. "
+        f"You are an assistant that creates SQL queries for table {FULLY_QUALIFIED_TABLE_NAME}. "
         "Examine the schema and create a concise summary highlighting the most important aspects. "
         "Focus on key columns, data types, relationships, and typical query patterns."
     )
     
-    # More focused system prompt for query generation
-    system_prompt: str = (
+    # More focused system prompt for query generation. The schema summary goes
+    # last so the fixed instructions form a stable prefix for prompt caching.
+    # fetch_schema renders it into system_prompt on every (re)load.
+    system_prompt_template: str = (
         "You are an AI assistant that helps users query and interact with the {table_name} table in SQL Server.\n\n"
         "You only have access to this specific table, not the entire database.\n\n"
-        "CONTEXT ABOUT THE TABLE:\n"
-        "{schema_summary}\n\n"
         "IMPORTANT INSTRUCTIONS:\n"
         "1. Always generate standard SQL Server T-SQL syntax\n"
         "2. Reference columns EXACTLY as they appear in the schema\n"
@@ -103,8 +200,11 @@ class Chat:
         "- To view recent query logs: /show-logs [number]\n"
         "- To refresh table schema: /refresh_schema\n"
         "- To view query history: /history\n\n"
-        "Format: TOOL: query_table, ARGS: {{\"sql\": \"<SQL_QUERY>\"}}"
+        "Format: TOOL: query_table, ARGS: {{\"sql\": \"<SQL_QUERY>\"}}\n\n"
+        "CONTEXT ABOUT THE TABLE:\n"
+        "{schema_summary}"
     )
+    system_prompt: str = ""
     
     # Minimal system prompt for result explanation
     explanation_system_prompt: str = (
@@ -155,7 +255,7 @@ class Chat:
             
             completion_params = {
                 "messages": [
-                    {"role": "system", "content": self.schema_system_prompt.format(table_name=FULLY_QUALIFIED_TABLE_NAME)},
+                    {"role": "system", "content": self.schema_system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 "max_tokens": 500,
@@ -232,9 +332,11 @@ Schema retrieval encountered errors. Limited table information available:
                 self.table_schema = "Both full schema and basic table information retrieval failed."
                 self.schema_summary = f"Table: {FULLY_QUALIFIED_TABLE_NAME}"
             
-        # Update the system prompt with schema information - use the summary instead of full schema
+        # Update the system prompt with schema information - use the summary instead of full schema.
+        # Always render from the template: formatting the previous prompt again would fail
+        # on its literal braces and leave the old schema in place after /refresh_schema.
         try:
-            self.system_prompt = self.system_prompt.format(
+            self.system_prompt = self.system_prompt_template.format(
                 schema_summary=self.schema_summary,
                 table_name=FULLY_QUALIFIED_TABLE_NAME
             )
@@ -242,7 +344,7 @@ Schema retrieval encountered errors. Limited table information available:
         except Exception as format_error:
             print(f"Error formatting system prompt: {format_error}")
             # Fallback to direct replacement if formatting fails
-            self.system_prompt = self.system_prompt.replace("{schema_summary}", self.schema_summary)
+            self.system_prompt = self.system_prompt_template.replace("{schema_summary}", self.schema_summary)
             self.system_prompt = self.system_prompt.replace("{table_name}", FULLY_QUALIFIED_TABLE_NAME)
 
     def extract_sql_from_assistant_reply(self, assistant_reply: str) -> Optional[Dict[str, Any]]:
@@ -250,8 +352,7 @@ Schema retrieval encountered errors. Limited table information available:
         # Try the TOOL format first
         if "TOOL:" in assistant_reply:
             try:
-                pattern = r"TOOL:\s*(\w+),\s*ARGS:\s*(\{.*\})"
-                match = re.search(pattern, assistant_reply)
+                match = _TOOL_CALL_RE.search(assistant_reply)
                 if match:
                     tool_name = match.group(1)
                     tool_args_str = match.group(2)
@@ -261,8 +362,7 @@ Schema retrieval encountered errors. Limited table information available:
                         return {"tool_name": tool_name, "args": tool_args}
                     except json.JSONDecodeError as json_err:
                         # Try to extract SQL directly as fallback
-                        sql_pattern = r'"sql":\s*"(.+?)"'
-                        sql_match = re.search(sql_pattern, tool_args_str)
+                        sql_match = _SQL_ARG_RE.search(tool_args_str)
                         if sql_match:
                             sql = sql_match.group(1)
                             return {"tool_name": tool_name, "args": {"sql": sql}}
@@ -270,20 +370,18 @@ Schema retrieval encountered errors. Limited table information available:
                 pass
         
         # Try SQL code block extraction as fallback
-        sql_pattern = r'```sql\s*(.*?)\s*```'
-        sql_match = re.search(sql_pattern, assistant_reply, re.DOTALL)
+        sql_match = _SQL_CODE_BLOCK_RE.search(assistant_reply)
         if sql_match:
             sql = sql_match.group(1).strip()
             return {"tool_name": "query_table", "args": {"sql": sql}}
         
         # Try direct SQL extraction (for cases where model outputs just the SQL)
-        if re.search(r'\bSELECT\b', assistant_reply, re.IGNORECASE) and \
-           re.search(r'\bFROM\b', assistant_reply, re.IGNORECASE):
+        if _SELECT_RE.search(assistant_reply) and _FROM_RE.search(assistant_reply):
             # Extract what looks like a SQL query
             lines = assistant_reply.split('\n')
             sql_lines = []
             for line in lines:
-                if re.search(r'\b(SELECT|FROM|WHERE|ORDER BY|GROUP BY|HAVING|JOIN)\b', line, re.IGNORECASE):
+                if _SQL_LINE_RE.search(line):
                     sql_lines.append(line)
             
             if sql_lines:
@@ -347,8 +445,7 @@ Schema retrieval encountered errors. Limited table information available:
                 
                 try:
                     # Detect if this is likely a calculation/percentage query
-                    has_calculation = any(op in current_iteration.generated_sql.upper() 
-                                          for op in [' / ', '*', '+', '-', 'AVG(', 'SUM(', 'COUNT(', 'CAST(', 'CONVERT('])
+                    has_calculation = _CALC_RE.search(current_iteration.generated_sql) is not None
                     
                     result = await session.call_tool("query_table", {"sql": current_iteration.generated_sql})
                     result_text = getattr(result.content[0], "text", "")
@@ -361,7 +458,7 @@ Schema retrieval encountered errors. Limited table information available:
                     execution_summary = "Query executed successfully."
                     if "rows returned" in result_text:
                         try:
-                            rows_count = re.search(r"(\d+) rows returned", result_text).group(1)
+                            rows_count = _ROWS_RETURNED_RE.search(result_text).group(1)
                             execution_summary = f"Query executed successfully. {rows_count} rows returned."
                         except:
                             pass
@@ -484,22 +581,23 @@ Schema retrieval encountered errors. Limited table information available:
             # First iteration, just the query
             prompt = original_query
         
-        # Generate a cache key for this query/feedback combination
-        cache_key = f"sql:{hash(prompt)}"
+        # Build minimal conversation for OpenAI
+        openai_messages = [
+            {"role": "system", "content": self.system_prompt},
+        ]
+        
+        # Only include 1-2 previous exchanges to minimize tokens
+        if iteration_number > 1 and len(self.messages) >= 2:
+            # Add just the most recent exchange
+            openai_messages.extend(self.messages[-2:])
+        
+        # Key the cache on everything sent to the model, so a refreshed schema
+        # or different context never replays SQL generated for other messages
+        cache_key = completion_cache_key("sql", openai_messages + [{"role": "user", "content": normalize_prompt(prompt)}])
         if cache_key in self.response_cache:
             print("Using cached SQL response")
             assistant_reply = self.response_cache[cache_key]
         else:
-            # Build minimal conversation for OpenAI
-            openai_messages = [
-                {"role": "system", "content": self.system_prompt},
-            ]
-            
-            # Only include 1-2 previous exchanges to minimize tokens
-            if iteration_number > 1 and len(self.messages) >= 2:
-                # Add just the most recent exchange
-                openai_messages.extend(self.messages[-2:])
-            
             openai_messages.append({"role": "user", "content": prompt})
             
             # Send to OpenAI with minimal token settings
@@ -566,16 +664,15 @@ Schema retrieval encountered errors. Limited table information available:
     async def generate_result_explanation(self, session: ClientSession, 
                                          query: str, sql: str, results: str) -> None:
         """Generate a natural language explanation of the query results with minimal tokens."""
-        # Check cache first
-        cache_key = f"explanation:{hash(results)}"
-        if cache_key in self.response_cache:
-            explanation = self.response_cache[cache_key]
+        # Trivial results get a fixed explanation instead of a model call
+        explanation = canned_explanation(sql, results)
+        if explanation is not None:
             print("\n===== RESULT EXPLANATION =====")
             print(explanation)
             print("==============================\n")
             self.messages.append({"role": "assistant", "content": explanation})
             return
-            
+        
         # Extract just the tabular part for the explanation (without the JSON)
         # And limit the size to reduce token usage
         results_for_explanation = results.split("\n\nJSON_DATA:")[0] if "JSON_DATA:" in results else results
@@ -599,29 +696,47 @@ Schema retrieval encountered errors. Limited table information available:
             {"role": "user", "content": prompt}
         ]
         
+        # Check cache first; the key covers the question and SQL, not just the results
+        cache_key = completion_cache_key("explanation", openai_messages)
+        if cache_key in self.response_cache:
+            explanation = self.response_cache[cache_key]
+            print("\n===== RESULT EXPLANATION =====")
+            print(explanation)
+            print("==============================\n")
+            self.messages.append({"role": "assistant", "content": explanation})
+            return
+        
         # Send to OpenAI with minimal token settings
         completion_params = {
             "messages": openai_messages,
             "max_tokens": 500,  # Reduced from 1000
             "temperature": 0.1,
-            "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_ID")
+            "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_ID"),
+            "stream": True
         }
         
+        # Print the explanation as it is generated instead of waiting for the whole completion
+        print("\n===== RESULT EXPLANATION =====")
+        parts = []
         try:
-            completion = client.chat.completions.create(**completion_params)
-            explanation = completion.choices[0].message.content
+            for chunk in client.chat.completions.create(**completion_params):
+                # Azure sends chunks without choices (e.g. content filter results)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text = chunk.choices[0].delta.content
+                    parts.append(text)
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+            explanation = "".join(parts)
             
             # Cache the explanation
             self.response_cache[cache_key] = explanation
             
-            print("\n===== RESULT EXPLANATION =====")
-            print(explanation)
-            print("==============================\n")
+            print("\n==============================\n")
             
             # Add explanation to conversation history
             self.messages.append({"role": "assistant", "content": explanation})
         except Exception as e:
-            print(f"Error generating result explanation: {str(e)}")
+            print(f"\nError generating result explanation: {str(e)}")
 
     async def show_query_history(self):
         """Display the history of queries executed in this session."""
@@ -666,6 +781,8 @@ Schema retrieval encountered errors. Limited table information available:
                 await self.run_diagnostics(session)
                 continue
             elif query.lower() == "/refresh_schema":
+                # Drop the server-side schema cache so the reload hits the database
+                await session.call_tool("refresh_schema", {})
                 await self.fetch_schema(session)
                 continue
             elif query.lower() == "/history":
@@ -5,10 +5,23 @@ import sys
 import json
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date
+from decimal import Decimal
+import uuid
+import time
 import tabulate
 import re
 import math
+import queue
+import threading
+import atexit
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import orjson  # Optional: much faster JSON encoding for large result sets
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
@@ -21,14 +34,17 @@ log_file = os.path.join(log_path, f"mcp_server_{datetime.now().strftime('%Y%m%d'
 logger.remove()
 # Console handler with INFO level
 logger.add(sys.stderr, level="INFO")
-# File handler with DEBUG level and rotation
+# File handler with rotation; per-query DEBUG tracing only when MCP_TRACE=1.
+# enqueue=True hands writes to loguru's background thread so tool calls don't block on disk.
+MCP_TRACE = os.getenv("MCP_TRACE", "0") == "1"
 logger.add(
     log_file, 
-    level="DEBUG", 
+    level="DEBUG" if MCP_TRACE else "INFO", 
     rotation="5 MB", 
     retention="1 week",
     backtrace=True, 
-    diagnose=True
+    diagnose=True,
+    enqueue=True
 )
 
 logger.info(f"Starting MCP SQL Server with logging to {log_file}")
@@ -39,12 +55,34 @@ MSSQL_DATABASE = os.getenv("MSSQL_DATABASE", "my_database")
 MSSQL_USERNAME = os.getenv("MSSQL_USERNAME", "sa")
 MSSQL_PASSWORD = os.getenv("MSSQL_PASSWORD", "your_password")
 MSSQL_DRIVER = os.getenv("MSSQL_DRIVER", "{ODBC Driver 18 for SQL Server}")
+# TDS packet size in bytes; larger packets mean fewer network buffers per result set
+MSSQL_PACKET_SIZE = int(os.getenv("MSSQL_PACKET_SIZE", "32767"))
 
 # Table configuration
 MSSQL_TABLE_SCHEMA = os.getenv("MSSQL_TABLE_SCHEMA", "dbo")
 MSSQL_TABLE_NAME = os.getenv("MSSQL_TABLE_NAME", "your_table_name")
 FULLY_QUALIFIED_TABLE_NAME = f"{MSSQL_TABLE_SCHEMA}.{MSSQL_TABLE_NAME}" if MSSQL_TABLE_SCHEMA else MSSQL_TABLE_NAME
 
+# Upper-cased table names for the query_table security check
+_TABLE_REF_UPPER = FULLY_QUALIFIED_TABLE_NAME.upper()
+_TABLE_NAME_UPPER = MSSQL_TABLE_NAME.upper()
+# Names accepted for the configured table: table, schema.table or <this database>.schema.table
+_ALLOWED_TABLE_REFS = frozenset(
+    {_TABLE_REF_UPPER, _TABLE_NAME_UPPER}
+    | ({f"{MSSQL_DATABASE}.{_TABLE_REF_UPPER}".upper()} if MSSQL_TABLE_SCHEMA else set())
+)
+
+def quote_identifier(name):
+    """Quote a SQL Server identifier the same way QUOTENAME() does."""
+    return "[" + name.replace("]", "]]") + "]"
+
+# Bracket-quoted table name used inside generated SQL. Names with spaces or brackets
+# stay valid, and statement text is identical on every call for plan cache reuse.
+QUOTED_TABLE_NAME = (
+    f"{quote_identifier(MSSQL_TABLE_SCHEMA)}.{quote_identifier(MSSQL_TABLE_NAME)}"
+    if MSSQL_TABLE_SCHEMA else quote_identifier(MSSQL_TABLE_NAME)
+)
+
 # Building the connection string
 connection_string = (
     f"DRIVER={MSSQL_DRIVER};"
@@ -55,411 +93,1147 @@ connection_string = (
     f"Authentication=SqlPassword;"
     f"Encrypt=yes;"
     f"TrustServerCertificate=yes;"
+    f"Packet Size={MSSQL_PACKET_SIZE};"
     f"Connection Timeout=30"
 )
 
-logger.debug(f"Connection string created (password masked): DRIVER={MSSQL_DRIVER};SERVER={MSSQL_SERVER};DATABASE={MSSQL_DATABASE};UID={MSSQL_USERNAME};PWD=******;Authentication=SqlPassword;Encrypt=yes;TrustServerCertificate=yes")
+logger.debug(
+    "Connection string created (password masked): DRIVER={};SERVER={};DATABASE={};UID={};PWD=******;Authentication=SqlPassword;Encrypt=yes;TrustServerCertificate=yes;Packet Size={}",
+    MSSQL_DRIVER, MSSQL_SERVER, MSSQL_DATABASE, MSSQL_USERNAME, MSSQL_PACKET_SIZE
+)
 logger.info(f"Configured to work with table: {FULLY_QUALIFIED_TABLE_NAME}")
 
+# Keep a few live connections around so tool calls skip the ODBC handshake and login
+pyodbc.pooling = True
+MSSQL_POOL_SIZE = int(os.getenv("MSSQL_POOL_SIZE", "8"))
+# Read-only deployments can run every session at READ UNCOMMITTED to avoid lock waits
+MSSQL_READ_UNCOMMITTED = os.getenv("MSSQL_READ_UNCOMMITTED", "0") == "1"
+# Connections idle longer than this are checked with SELECT 1 before reuse
+POOL_IDLE_CHECK_SECONDS = 60
+# Idle (connection, returned_at) pairs, most recently returned first
+_POOL = queue.LifoQueue(maxsize=MSSQL_POOL_SIZE)
+
+def _open_connection(autocommit=True):
+    conn = pyodbc.connect(connection_string, autocommit=autocommit)
+    if MSSQL_READ_UNCOMMITTED:
+        conn.execute("SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED")
+    return conn
+
+def _checkout_connection():
+    # Reuse an idle connection if one is still alive, otherwise open a new one
+    while True:
+        try:
+            conn, returned_at = _POOL.get_nowait()
+        except queue.Empty:
+            return _open_connection()
+        if time.monotonic() - returned_at < POOL_IDLE_CHECK_SECONDS:
+            return conn
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except pyodbc.Error as e:
+            logger.warning(f"Discarding stale pooled connection: {str(e)}")
+            conn.close()
+
+class _TrackedConnection:
+    """Proxy for a pooled connection, and the cursors it hands out, that records pyodbc errors.
+    
+    Tools catch database errors inside ``with get_conn()`` to report them, so
+    the block still exits normally; ``failed`` tells get_conn not to pool a
+    connection whose link may be dead.
+    """
+    
+    def __init__(self, target, root=None):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_root", root or self)
+        object.__setattr__(self, "failed", False)
+    
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        
+        def call(*args, **kwargs):
+            try:
+                result = attr(*args, **kwargs)
+            except pyodbc.Error:
+                object.__setattr__(self._root, "failed", True)
+                raise
+            # conn.cursor(), conn.execute() and cursor.execute() return cursors to track too
+            if isinstance(result, pyodbc.Cursor):
+                return _TrackedConnection(result, self._root)
+            return result
+        return call
+    
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection, opening a new one if none is idle.
+    
+    The connection goes back to the pool only when the block exits normally
+    without any pyodbc error, even a caught one; otherwise it is closed, so a
+    broken connection is never reused. Connections that sat idle for a while
+    are pinged first. Pooled connections run in autocommit mode and are only
+    used for the server's own metadata queries; query_table uses
+    get_query_conn() instead.
+    """
+    conn = _checkout_connection()
+    tracked = _TrackedConnection(conn)
+    try:
+        yield tracked
+    except BaseException:
+        conn.close()
+        raise
+    if tracked.failed:
+        logger.warning("Discarding pooled connection after a database error")
+        conn.close()
+        return
+    try:
+        _POOL.put_nowait((conn, time.monotonic()))
+    except queue.Full:
+        conn.close()
+
+@contextmanager
+def get_query_conn():
+    """Open a connection for client-supplied SQL; it is never returned to _POOL.
+    
+    Arbitrary SQL can leave session state behind (USE, SET ROWCOUNT, isolation
+    level, an open transaction) that must not leak into later tool calls. The
+    connection runs in a transaction that the caller commits; anything left
+    uncommitted is rolled back on exit. close() hands the connection back to
+    ODBC driver-manager pooling (pyodbc.pooling), which resets the session
+    before reusing it.
+    """
+    conn = _open_connection(autocommit=False)
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+        except pyodbc.Error:
+            pass
+        conn.close()
+
+# Connection details appended after the error line when get_table_schema hits an ODBC error
+_CONNECTION_ERROR_DETAILS = f"""
+- Server: {MSSQL_SERVER}
+- Database: {MSSQL_DATABASE}
+- Table: {FULLY_QUALIFIED_TABLE_NAME}
+- Username: {MSSQL_USERNAME}
+- Driver: {MSSQL_DRIVER}
+
+Please check your connection settings in the .env file and ensure you have access to the specified table.
+"""
+
+# Seconds a get_table_schema report is served without re-checking the table
+SCHEMA_TTL_SECONDS = int(os.getenv("SCHEMA_TTL_SECONDS", "300"))
+# The version probe can't see UPDATEs, so a report (with its statistics and sample
+# rows) is rebuilt once it is this old even if the table looks unchanged
+SCHEMA_MAX_AGE_SECONDS = int(os.getenv("SCHEMA_MAX_AGE_SECONDS", "3600"))
+
+# Layout of the JSON_DATA section returned by query_table: "records" or "columnar"
+JSON_DATA_FORMAT = os.getenv("MCP_JSON_DATA_FORMAT", "records").strip().lower()
+
+# Result set limits for query_table (a limit of 0 or less disables truncation)
+QUERY_ROW_LIMIT = int(os.getenv("MCP_QUERY_ROW_LIMIT", "10000"))
+FETCH_BATCH_SIZE = 1000
+# Rows beyond this are left out of the text grid (they remain in JSON_DATA)
+MAX_RENDER_ROWS = int(os.getenv("MCP_MAX_RENDER_ROWS", "1000"))
+# Grids with more rows than this use render_grid instead of tabulate
+TABULATE_MAX_ROWS = 50
+
 # Creating an MCP server instance
 mcp = FastMCP("Demo")
 
+# Parameterized metadata queries. Keeping the statement text constant lets SQL
+# Server reuse one cached plan for every call instead of re-parsing each time.
+_COLUMNS_QUERY = """
+    SELECT
+        COLUMN_NAME,
+        DATA_TYPE,
+        CHARACTER_MAXIMUM_LENGTH,
+        IS_NULLABLE,
+        COLUMNPROPERTY(?, COLUMN_NAME, 'IsIdentity') AS IS_IDENTITY,
+        COLUMN_DEFAULT,
+        NUMERIC_PRECISION,
+        NUMERIC_SCALE
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
+    ORDER BY ORDINAL_POSITION
+"""
+
+_PRIMARY_KEYS_QUERY = """
+    SELECT c.COLUMN_NAME
+    FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+    JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE c
+        ON c.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+    WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+        AND tc.TABLE_SCHEMA = ?
+        AND tc.TABLE_NAME = ?
+"""
+
+_FOREIGN_KEYS_QUERY = """
+    SELECT
+        fk.name AS FK_NAME,
+        OBJECT_NAME(fk.parent_object_id) AS TABLE_NAME,
+        COL_NAME(fkc.parent_object_id, fkc.parent_column_id) AS COLUMN_NAME,
+        OBJECT_NAME(fk.referenced_object_id) AS REFERENCED_TABLE_NAME,
+        COL_NAME(fkc.referenced_object_id, fkc.referenced_column_id) AS REFERENCED_COLUMN_NAME
+    FROM
+        sys.foreign_keys AS fk
+    INNER JOIN
+        sys.foreign_key_columns AS fkc ON fk.OBJECT_ID = fkc.constraint_object_id
+    WHERE
+        fk.parent_object_id = ?
+"""
+
+_INDEXES_QUERY = """
+    SELECT
+        i.name AS INDEX_NAME,
+        i.type_desc AS INDEX_TYPE,
+        STRING_AGG(c.name, ', ') WITHIN GROUP (ORDER BY ic.key_ordinal) AS COLUMN_NAMES,
+        i.is_unique
+    FROM
+        sys.indexes i
+    INNER JOIN
+        sys.index_columns ic ON i.object_id = ic.object_id AND i.index_id = ic.index_id
+    INNER JOIN
+        sys.columns c ON ic.object_id = c.object_id AND ic.column_id = c.column_id
+    WHERE
+        i.object_id = ? AND i.name IS NOT NULL
+    GROUP BY
+        i.name, i.type_desc, i.is_unique
+"""
+
+_TABLE_EXISTS_QUERY = """
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
+"""
+
+# Row count from partition metadata (heap or clustered index) instead of scanning the table
+_ROW_COUNT_QUERY = """
+    SELECT SUM(p.rows)
+    FROM sys.partitions p
+    WHERE p.object_id = ? AND p.index_id IN (0, 1)
+"""
+
+# Sample rows for the get_table_schema preview; NOLOCK so it never waits on writers
+_SAMPLE_ROWS_QUERY = f"SELECT TOP 5 * FROM {QUOTED_TABLE_NAME} WITH (NOLOCK)"
+
+# get_table_schema's metadata queries and sample rows sent as one batch; each
+# returns its own result set, with the sample last so a failure there can't
+# hide the metadata. _INDEXES_QUERY stays out: STRING_AGG needs SQL Server 2017+,
+# and a compile error would fail the whole batch instead of one section.
+_METADATA_BATCH = ";\n".join([
+    _COLUMNS_QUERY,
+    _PRIMARY_KEYS_QUERY,
+    _FOREIGN_KEYS_QUERY,
+    _ROW_COUNT_QUERY,
+    _SAMPLE_ROWS_QUERY,
+])
+
+# Cheap probe used to decide whether a cached schema report is still current:
+# object_id changes if the table is recreated, modify_date on DDL, and the
+# partition row count on inserts/deletes
+_SCHEMA_VERSION_QUERY = """
+    SELECT o.object_id, o.modify_date, SUM(p.rows)
+    FROM sys.objects o
+    JOIN sys.partitions p ON p.object_id = o.object_id AND p.index_id IN (0, 1)
+    WHERE o.object_id = OBJECT_ID(?)
+    GROUP BY o.object_id, o.modify_date
+"""
+
+# OBJECT_ID of the configured table, resolved once and refreshed by the version probe
+_TABLE_OBJECT_ID = None
+
+# Effective object-level permissions of the current login on the table
+_MY_PERMISSIONS_QUERY = """
+    SELECT permission_name
+    FROM fn_my_permissions(?, 'OBJECT')
+    WHERE subentity_name = ''
+"""
+
+# diagnose_table_access checks sent as one batch
+_DIAGNOSTICS_BATCH = _TABLE_EXISTS_QUERY + ";\n" + _MY_PERMISSIONS_QUERY
+
+# get_table_schema reports keyed by (schema, table) -> (version, checked_at, report text, schema_dict, built_at).
+# checked_at and built_at are time.monotonic() timestamps of the last version check and of the build.
+_SCHEMA_CACHE = {}
+
+def _identity(value):
+    return value
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+def _finite_float(value):
+    # NaN/Infinity are not valid JSON, so they are passed on as strings
+    return value if value is None or math.isfinite(value) else str(value)
+
+# serialize_value handlers keyed by exact type; anything else falls back to
+# isoformat() (dates and times) or str()
+_SERIALIZERS = {
+    type(None): _identity,
+    int: _identity,
+    str: _identity,
+    bool: _identity,
+    float: _finite_float,
+    datetime: str,
+    date: date.isoformat,
+    bytes: str,
+    bytearray: str,
+    Decimal: str,
+    uuid.UUID: str,
+}
+
 def serialize_value(value):
     """Convert SQL values to a serializable format for JSON"""
-    if value is None:
-        return None
-    elif isinstance(value, (datetime, bytes, bytearray)):
-        return str(value)
-    elif isinstance(value, (int, float, str, bool)):
-        # Handle NaN, Infinity values that cause JSON serialization issues
-        if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
-            return str(value)
-        return value
-    elif hasattr(value, 'isoformat'):  # For date/time objects
+    handler = _SERIALIZERS.get(type(value))
+    if handler is not None:
+        return handler(value)
+    if hasattr(value, 'isoformat'):  # For date/time objects
         return value.isoformat()
-    else:
-        return str(value)
+    return str(value)
+
+def _table_object_id(cursor):
+    """Return the configured table's OBJECT_ID, looking it up only once."""
+    global _TABLE_OBJECT_ID
+    if _TABLE_OBJECT_ID is None:
+        cursor.execute("SELECT OBJECT_ID(?)", QUOTED_TABLE_NAME)
+        _TABLE_OBJECT_ID = cursor.fetchone()[0]
+    return _TABLE_OBJECT_ID
+
+def fetch_result_sets(cursor, count=None):
+    """Fetch the result sets produced by the last executed batch, in order.
+    
+    With count, stops after that many sets and leaves the rest pending on the cursor.
+    """
+    result_sets = [cursor.fetchall()]
+    while (count is None or len(result_sets) < count) and cursor.nextset():
+        result_sets.append(cursor.fetchall())
+    return result_sets
+
+def _fetch_section(cursor, sql, params=()):
+    """Run one get_table_schema query on its own, returning its rows or the pyodbc.Error it raised."""
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except pyodbc.Error as e:
+        return e
+
+def _schema_version(cursor):
+    """Return an (object_id, modify_date, row_count) tuple identifying the table's current state.
+    
+    Also refreshes the cached OBJECT_ID. Returns None if the probe fails,
+    which callers treat as a cache miss.
+    """
+    global _TABLE_OBJECT_ID
+    try:
+        cursor.execute(_SCHEMA_VERSION_QUERY, QUOTED_TABLE_NAME)
+        row = cursor.fetchone()
+        if not row:
+            return None
+        _TABLE_OBJECT_ID = row[0]
+        return tuple(row)
+    except pyodbc.Error as e:
+        logger.warning(f"Could not probe schema version: {str(e)}")
+        return None
 
 @mcp.tool()
 def get_table_schema() -> str:
     """Retrieve detailed schema information for the specific table."""
     logger.info(f"Retrieving schema information for table {FULLY_QUALIFIED_TABLE_NAME}...")
+    
+    # Within the TTL the cached report is returned without touching the database
+    cache_key = (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME)
+    cached = _SCHEMA_CACHE.get(cache_key)
+    if cached and time.monotonic() - cached[1] < SCHEMA_TTL_SECONDS:
+        logger.info("Returning cached schema (checked less than {} seconds ago)", SCHEMA_TTL_SECONDS)
+        return cached[2]
+    
     try:
         # Log connection attempt
-        logger.debug(f"Attempting to connect to server: {MSSQL_SERVER}, database: {MSSQL_DATABASE}")
-        
-        conn = pyodbc.connect(connection_string)
-        logger.debug("Database connection established successfully")
-        cursor = conn.cursor()
-        
-        schema_info = []
-        schema_info.append(f"Table: {FULLY_QUALIFIED_TABLE_NAME}")
-        
-        # Dictionary to store all schema elements
-        schema_dict = {
-            "columns": [],
-            "numeric_columns": [],
-            "primary_keys": [],
-            "foreign_keys": [],
-            "indexes": [],
-            "row_count": None,
-            "numeric_stats": {}  # Will store statistics for numeric columns
-        }
+        logger.debug("Attempting to connect to server: {}, database: {}", MSSQL_SERVER, MSSQL_DATABASE)
         
-        # Get columns for the table with comprehensive details
-        try:
-            logger.debug(f"Querying columns for {FULLY_QUALIFIED_TABLE_NAME}")
-            cursor.execute(f"""
-                SELECT 
-                    COLUMN_NAME, 
-                    DATA_TYPE, 
-                    CHARACTER_MAXIMUM_LENGTH, 
-                    IS_NULLABLE,
-                    COLUMNPROPERTY(OBJECT_ID(CONCAT(TABLE_SCHEMA, '.', TABLE_NAME)), COLUMN_NAME, 'IsIdentity') AS IS_IDENTITY,
-                    COLUMN_DEFAULT,
-                    NUMERIC_PRECISION,
-                    NUMERIC_SCALE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-                ORDER BY ORDINAL_POSITION
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
+        with get_conn() as conn:
+            logger.debug("Database connection established successfully")
+            cursor = conn.cursor()
+        
+            # Past the TTL, reuse the previous report if the table hasn't changed since it
+            # was built. UPDATEs don't change the version, so old reports are rebuilt anyway.
+            version = _schema_version(cursor)
+            now = time.monotonic()
+            if version is not None and cached and cached[0] == version and now - cached[4] < SCHEMA_MAX_AGE_SECONDS:
+                logger.info("Table unchanged since last schema retrieval - returning cached schema")
+                _SCHEMA_CACHE[cache_key] = (version, now, cached[2], cached[3], cached[4])
+                return cached[2]
+        
+            schema_info = []
+            schema_info.append(f"Table: {FULLY_QUALIFIED_TABLE_NAME}")
+        
+            # Dictionary to store all schema elements
+            schema_dict = {
+                "columns": [],
+                "numeric_columns": [],
+                "primary_keys": [],
+                "foreign_keys": [],
+                "indexes": [],
+                "row_count": None,
+                "numeric_stats": {}  # Will store statistics for numeric columns
+            }
+        
+            # Columns, keys, row count and sample rows come back as result sets of one batch
+            logger.debug("Querying table metadata for {}", FULLY_QUALIFIED_TABLE_NAME)
+            object_id = _table_object_id(cursor)
+            section_queries = [
+                (_COLUMNS_QUERY, (object_id, MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME)),
+                (_PRIMARY_KEYS_QUERY, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME)),
+                (_FOREIGN_KEYS_QUERY, (object_id,)),
+                (_ROW_COUNT_QUERY, (object_id,)),
+            ]
+            try:
+                cursor.execute(_METADATA_BATCH, [param for _, params in section_queries for param in params])
+                columns_rows, pk_rows, fk_rows, count_rows = fetch_result_sets(cursor, len(section_queries))
+                batch_error = None
+            except pyodbc.Error as e:
+                # Run the queries one at a time so a failure only costs its own section
+                logger.warning(f"Schema metadata batch failed, querying sections separately: {str(e)}")
+                columns_rows, pk_rows, fk_rows, count_rows = [
+                    _fetch_section(cursor, sql, params) for sql, params in section_queries
+                ]
+                batch_error = e
             
-            columns = cursor.fetchall()
-            logger.debug(f"Found {len(columns)} columns for table {FULLY_QUALIFIED_TABLE_NAME}")
+            # Read the sample now, before the index and statistics queries replace the pending results
+            try:
+                if batch_error is None:
+                    sample_rows = cursor.fetchall() if cursor.nextset() else []
+                else:
+                    cursor.execute(_SAMPLE_ROWS_QUERY)
+                    sample_rows = cursor.fetchall()
+                sample_description = cursor.description
+            except pyodbc.Error as e:
+                logger.warning(f"Could not retrieve sample data: {str(e)}")
+                sample_rows, sample_description = None, None
             
-            if not columns:
-                logger.warning(f"No columns found for table {FULLY_QUALIFIED_TABLE_NAME}")
-                return f"No columns found for table {FULLY_QUALIFIED_TABLE_NAME}. Please check if the table exists and you have access to it."
+            # Sections below report a failed query through their own except blocks
+            numeric_column_names = []
+            pk_columns = []
+        
+            # Get columns for the table with comprehensive details
+            try:
+                if isinstance(columns_rows, pyodbc.Error):
+                    raise columns_rows
+                columns = columns_rows
+                logger.debug("Found {} columns for table {}", len(columns), FULLY_QUALIFIED_TABLE_NAME)
             
-            schema_info.append("\nColumn Details:")
-            column_details = []
+                if not columns:
+                    logger.warning(f"No columns found for table {FULLY_QUALIFIED_TABLE_NAME}")
+                    return f"No columns found for table {FULLY_QUALIFIED_TABLE_NAME}. Please check if the table exists and you have access to it."
             
-            # Collect numeric column names for statistics
-            numeric_column_names = []
+                schema_info.append("\nColumn Details:")
+                column_details = []
             
-            for col_name, data_type, max_length, is_nullable, is_identity, default_val, numeric_precision, numeric_scale in columns:
-                nullable_str = "NULL" if is_nullable == 'YES' else "NOT NULL"
-                identity_str = " IDENTITY" if is_identity == 1 else ""
-                default_str = f" DEFAULT {default_val}" if default_val else ""
+                for col_name, data_type, max_length, is_nullable, is_identity, default_val, numeric_precision, numeric_scale in columns:
+                    nullable_str = "NULL" if is_nullable == 'YES' else "NOT NULL"
+                    identity_str = " IDENTITY" if is_identity == 1 else ""
+                    default_str = f" DEFAULT {default_val}" if default_val else ""
                 
-                # Store column information in schema dictionary
-                column_info = {
-                    "name": col_name,
-                    "data_type": data_type,
-                    "max_length": max_length,
-                    "is_nullable": is_nullable == 'YES',
-                    "is_identity": is_identity == 1,
-                    "default": default_val,
-                    "numeric_precision": numeric_precision,
-                    "numeric_scale": numeric_scale
-                }
-                schema_dict["columns"].append(column_info)
+                    # Store column information in schema dictionary
+                    column_info = {
+                        "name": col_name,
+                        "data_type": data_type,
+                        "max_length": max_length,
+                        "is_nullable": is_nullable == 'YES',
+                        "is_identity": is_identity == 1,
+                        "default": default_val,
+                        "numeric_precision": numeric_precision,
+                        "numeric_scale": numeric_scale
+                    }
+                    schema_dict["columns"].append(column_info)
                 
-                # Identify numeric columns for statistics
-                if data_type in ('int', 'bigint', 'smallint', 'tinyint', 'decimal', 'numeric', 'float', 'real', 'money', 'smallmoney'):
-                    numeric_column_names.append(col_name)
-                    schema_dict["numeric_columns"].append(column_info)
+                    # Identify numeric columns for statistics
+                    if data_type in ('int', 'bigint', 'smallint', 'tinyint', 'decimal', 'numeric', 'float', 'real', 'money', 'smallmoney'):
+                        numeric_column_names.append(col_name)
+                        schema_dict["numeric_columns"].append(column_info)
                 
-                if max_length and max_length != -1:
-                    column_details.append(f"- {col_name}: {data_type}({max_length}) {nullable_str}{identity_str}{default_str}")
-                elif data_type in ('varchar', 'nvarchar', 'char', 'nchar') and max_length == -1:
-                    column_details.append(f"- {col_name}: {data_type}(MAX) {nullable_str}{identity_str}{default_str}")
-                else:
-                    column_details.append(f"- {col_name}: {data_type} {nullable_str}{identity_str}{default_str}")
+                    if max_length and max_length != -1:
+                        column_details.append(f"- {col_name}: {data_type}({max_length}) {nullable_str}{identity_str}{default_str}")
+                    elif data_type in ('varchar', 'nvarchar', 'char', 'nchar') and max_length == -1:
+                        column_details.append(f"- {col_name}: {data_type}(MAX) {nullable_str}{identity_str}{default_str}")
+                    else:
+                        column_details.append(f"- {col_name}: {data_type} {nullable_str}{identity_str}{default_str}")
                 
-                if numeric_precision and numeric_scale:
-                    column_details.append(f"    Precision: {numeric_precision}, Scale: {numeric_scale}")
+                    if numeric_precision and numeric_scale:
+                        column_details.append(f"    Precision: {numeric_precision}, Scale: {numeric_scale}")
             
-            schema_info.extend(column_details)
-        except Exception as e:
-            error_msg = f"Error retrieving columns for {FULLY_QUALIFIED_TABLE_NAME}: {str(e)}"
-            logger.error(error_msg)
-            schema_info.append(f"Error: {error_msg}")
+                schema_info.extend(column_details)
+            except Exception as e:
+                error_msg = f"Error retrieving columns for {FULLY_QUALIFIED_TABLE_NAME}: {str(e)}"
+                logger.error(error_msg)
+                schema_info.append(f"Error: {error_msg}")
         
-        # Get primary keys
-        try:
-            logger.debug(f"Querying primary keys for {FULLY_QUALIFIED_TABLE_NAME}")
-            cursor.execute(f"""
-                SELECT c.COLUMN_NAME
-                FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-                JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE c 
-                    ON c.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
-                WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY' 
-                    AND tc.TABLE_SCHEMA = ? 
-                    AND tc.TABLE_NAME = ?
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-            
-            pk_columns = [row[0] for row in cursor.fetchall()]
-            schema_dict["primary_keys"] = pk_columns
+            # Get primary keys
+            try:
+                if isinstance(pk_rows, pyodbc.Error):
+                    raise pk_rows
+                pk_columns = [row[0] for row in pk_rows]
+                schema_dict["primary_keys"] = pk_columns
             
-            if pk_columns:
-                logger.debug(f"Found primary keys for {FULLY_QUALIFIED_TABLE_NAME}: {', '.join(pk_columns)}")
-                schema_info.append(f"\nPrimary Key: {', '.join(pk_columns)}")
-            else:
-                logger.debug(f"No primary keys found for {FULLY_QUALIFIED_TABLE_NAME}")
-                schema_info.append("\nPrimary Key: None defined")
-        except Exception as e:
-            error_msg = f"Error getting primary keys for {FULLY_QUALIFIED_TABLE_NAME}: {str(e)}"
-            logger.error(error_msg)
+                if pk_columns:
+                    logger.opt(lazy=True).debug("Found primary keys for {}: {}", lambda: FULLY_QUALIFIED_TABLE_NAME, lambda: ', '.join(pk_columns))
+                    schema_info.append(f"\nPrimary Key: {', '.join(pk_columns)}")
+                else:
+                    logger.debug("No primary keys found for {}", FULLY_QUALIFIED_TABLE_NAME)
+                    schema_info.append("\nPrimary Key: None defined")
+            except Exception as e:
+                error_msg = f"Error getting primary keys for {FULLY_QUALIFIED_TABLE_NAME}: {str(e)}"
+                logger.error(error_msg)
         
-        # Get foreign keys
-        try:
-            logger.debug(f"Querying foreign keys for {FULLY_QUALIFIED_TABLE_NAME}")
-            cursor.execute(f"""
-                SELECT 
-                    fk.name AS FK_NAME,
-                    OBJECT_NAME(fk.parent_object_id) AS TABLE_NAME,
-                    COL_NAME(fkc.parent_object_id, fkc.parent_column_id) AS COLUMN_NAME,
-                    OBJECT_NAME(fk.referenced_object_id) AS REFERENCED_TABLE_NAME,
-                    COL_NAME(fkc.referenced_object_id, fkc.referenced_column_id) AS REFERENCED_COLUMN_NAME
-                FROM 
-                    sys.foreign_keys AS fk
-                INNER JOIN 
-                    sys.foreign_key_columns AS fkc ON fk.OBJECT_ID = fkc.constraint_object_id
-                INNER JOIN 
-                    sys.tables AS t ON t.OBJECT_ID = fk.parent_object_id
-                INNER JOIN 
-                    sys.schemas AS s ON s.schema_id = t.schema_id
-                WHERE 
-                    s.name = ? AND t.name = ?
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-            
-            fk_results = cursor.fetchall()
-            schema_dict["foreign_keys"] = [
-                {
-                    "name": fk_name,
-                    "column": column,
-                    "referenced_table": ref_table,
-                    "referenced_column": ref_column
-                }
-                for fk_name, _, column, ref_table, ref_column in fk_results
-            ]
+            # Get foreign keys
+            try:
+                if isinstance(fk_rows, pyodbc.Error):
+                    raise fk_rows
+                fk_results = fk_rows
+                schema_dict["foreign_keys"] = [
+                    {
+                        "name": fk_name,
+                        "column": column,
+                        "referenced_table": ref_table,
+                        "referenced_column": ref_column
+                    }
+                    for fk_name, _, column, ref_table, ref_column in fk_results
+                ]
             
-            if fk_results:
-                schema_info.append("\nForeign Keys:")
-                for fk_name, _, column, ref_table, ref_column in fk_results:
-                    schema_info.append(f"- {column} -> {ref_table}.{ref_column} (FK: {fk_name})")
-            else:
-                schema_info.append("\nForeign Keys: None defined")
-        except Exception as e:
-            error_msg = f"Error getting foreign keys: {str(e)}"
-            logger.error(error_msg)
+                if fk_results:
+                    schema_info.append("\nForeign Keys:")
+                    for fk_name, _, column, ref_table, ref_column in fk_results:
+                        schema_info.append(f"- {column} -> {ref_table}.{ref_column} (FK: {fk_name})")
+                else:
+                    schema_info.append("\nForeign Keys: None defined")
+            except Exception as e:
+                error_msg = f"Error getting foreign keys: {str(e)}"
+                logger.error(error_msg)
         
-        # Get indexes
-        try:
-            logger.debug(f"Querying indexes for {FULLY_QUALIFIED_TABLE_NAME}")
-            cursor.execute(f"""
-                SELECT 
-                    i.name AS INDEX_NAME,
-                    i.type_desc AS INDEX_TYPE,
-                    STRING_AGG(c.name, ', ') WITHIN GROUP (ORDER BY ic.key_ordinal) AS COLUMN_NAMES,
-                    i.is_unique
-                FROM 
-                    sys.indexes i
-                INNER JOIN 
-                    sys.index_columns ic ON i.object_id = ic.object_id AND i.index_id = ic.index_id
-                INNER JOIN 
-                    sys.columns c ON ic.object_id = c.object_id AND ic.column_id = c.column_id
-                INNER JOIN 
-                    sys.tables t ON i.object_id = t.object_id
-                INNER JOIN 
-                    sys.schemas s ON t.schema_id = s.schema_id
-                WHERE 
-                    s.name = ? AND t.name = ? AND i.name IS NOT NULL
-                GROUP BY 
-                    i.name, i.type_desc, i.is_unique
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-            
-            idx_results = cursor.fetchall()
-            schema_dict["indexes"] = [
-                {
-                    "name": idx_name,
-                    "type": idx_type,
-                    "columns": columns.split(", "),
-                    "is_unique": is_unique
-                }
-                for idx_name, idx_type, columns, is_unique in idx_results
-            ]
+            # Get indexes
+            try:
+                cursor.execute(_INDEXES_QUERY, object_id)
+                idx_results = cursor.fetchall()
+                schema_dict["indexes"] = [
+                    {
+                        "name": idx_name,
+                        "type": idx_type,
+                        "columns": columns.split(", "),
+                        "is_unique": is_unique
+                    }
+                    for idx_name, idx_type, columns, is_unique in idx_results
+                ]
             
-            if idx_results:
-                schema_info.append("\nIndexes:")
-                for idx_name, idx_type, columns, is_unique in idx_results:
-                    unique_str = "UNIQUE " if is_unique else ""
-                    schema_info.append(f"- {idx_name}: {unique_str}{idx_type} on ({columns})")
-            else:
-                schema_info.append("\nIndexes: None defined (except for primary key)")
-        except Exception as e:
-            error_msg = f"Error getting indexes: {str(e)}"
-            logger.error(error_msg)
+                if idx_results:
+                    schema_info.append("\nIndexes:")
+                    for idx_name, idx_type, columns, is_unique in idx_results:
+                        unique_str = "UNIQUE " if is_unique else ""
+                        schema_info.append(f"- {idx_name}: {unique_str}{idx_type} on ({columns})")
+                else:
+                    schema_info.append("\nIndexes: None defined (except for primary key)")
+            except Exception as e:
+                error_msg = f"Error getting indexes: {str(e)}"
+                logger.error(error_msg)
         
-        # Get table statistics
-        try:
-            cursor.execute(f"SELECT COUNT(*) FROM {FULLY_QUALIFIED_TABLE_NAME}")
-            row_count = cursor.fetchone()[0]
-            schema_dict["row_count"] = row_count
-            schema_info.append(f"\nApproximate Row Count: {row_count}")
-        except Exception as e:
-            logger.warning(f"Could not retrieve row count: {str(e)}")
-            schema_info.append("\nRow Count: Unable to retrieve")
-            
-        # Get statistics for numeric columns
-        if numeric_column_names:
+            # Get table statistics
             try:
-                logger.debug(f"Collecting statistics for numeric columns: {numeric_column_names}")
-                schema_info.append("\nNumeric Column Statistics:")
-                
-                for column_name in numeric_column_names:
-                    try:
-                        # Try to get min, max, avg for each numeric column
-                        stats_query = f"""
-                            SELECT 
-                                MIN({column_name}) AS min_value,
-                                MAX({column_name}) AS max_value,
-                                AVG(CAST({column_name} AS FLOAT)) AS avg_value,
-                                COUNT({column_name}) AS count_value,
-                                COUNT(*) - COUNT({column_name}) AS null_count
-                            FROM {FULLY_QUALIFIED_TABLE_NAME}
-                            WHERE {column_name} IS NOT NULL
-                        """
-                        cursor.execute(stats_query)
-                        stats = cursor.fetchone()
-                        
-                        if stats and stats[0] is not None:
-                            min_val, max_val, avg_val, count_val, null_count = stats
-                            
-                            # Store in schema dictionary
-                            schema_dict["numeric_stats"][column_name] = {
-                                "min": min_val,
-                                "max": max_val,
-                                "avg": avg_val,
-                                "count": count_val,
-                                "null_count": null_count
-                            }
-                            
-                            # Format for display
-                            schema_info.append(f"- {column_name}:")
-                            schema_info.append(f"    Min: {min_val}, Max: {max_val}, Avg: {round(avg_val, 2) if avg_val is not None else 'N/A'}")
-                            schema_info.append(f"    Non-null values: {count_val}, Null values: {null_count}")
-                    except Exception as col_err:
-                        logger.warning(f"Could not retrieve statistics for column {column_name}: {str(col_err)}")
-                        schema_info.append(f"- {column_name}: Statistics unavailable")
-            except Exception as stats_err:
-                logger.warning(f"Error collecting numeric statistics: {str(stats_err)}")
-                schema_info.append("Could not collect numeric column statistics")
-        
-        # Add sample queries
-        schema_info.append(f"\nSample Queries:")
-        schema_info.append(f"- SELECT TOP 5 * FROM {FULLY_QUALIFIED_TABLE_NAME}")
-        schema_info.append(f"- SELECT COUNT(*) FROM {FULLY_QUALIFIED_TABLE_NAME}")
-        
-        # If primary key exists, add a sample query using it
-        if pk_columns:
-            pk_conditions = " AND ".join([f"{pk} = @value" for pk in pk_columns])
-            schema_info.append(f"- SELECT * FROM {FULLY_QUALIFIED_TABLE_NAME} WHERE {pk_conditions}")
-        
-        # Add sample data if available
-        try:
-            cursor.execute(f"SELECT TOP 5 * FROM {FULLY_QUALIFIED_TABLE_NAME}")
-            sample_rows = cursor.fetchall()
+                if isinstance(count_rows, pyodbc.Error):
+                    raise count_rows
+                row_count = count_rows[0][0]
+                if row_count is None:
+                    raise ValueError("table not found in sys.partitions")
+                schema_dict["row_count"] = row_count
+                schema_info.append(f"\nApproximate Row Count: {row_count}")
+            except Exception as e:
+                logger.warning(f"Could not retrieve row count: {str(e)}")
+                schema_info.append("\nRow Count: Unable to retrieve")
             
-            if sample_rows and cursor.description:
-                column_names = [column[0] for column in cursor.description]
+            # Get statistics for numeric columns
+            if numeric_column_names:
+                try:
+                    logger.debug("Collecting statistics for numeric columns: {}", numeric_column_names)
+                    schema_info.append(
+                        f"\nNumeric Column Statistics (may be up to {SCHEMA_MAX_AGE_SECONDS}s old; call refresh_schema for current values):"
+                    )
                 
-                schema_info.append("\nSample Data Preview:")
-                headers = column_names
-                table_data = []
+                    # One pass over the table: MIN, MAX, AVG and COUNT for every numeric column
+                    aggregates = []
+                    for column_name in numeric_column_names:
+                        quoted_column = quote_identifier(column_name)
+                        aggregates.append(
+                            f"MIN({quoted_column}), MAX({quoted_column}), "
+                            f"AVG(CAST({quoted_column} AS FLOAT)), COUNT({quoted_column})"
+                        )
+                    # NOLOCK: approximate stats are fine and shouldn't wait on writers
+                    cursor.execute(f"SELECT {', '.join(aggregates)}, COUNT(*) FROM {QUOTED_TABLE_NAME} WITH (NOLOCK)")
+                    stats = cursor.fetchone()
+                    total_rows = stats[-1]
+                
+                    for i, column_name in enumerate(numeric_column_names):
+                        min_val, max_val, avg_val, count_val = stats[i * 4:i * 4 + 4]
+                        if min_val is None:
+                            continue
+                        null_count = total_rows - count_val
+                    
+                        # Store in schema dictionary
+                        schema_dict["numeric_stats"][column_name] = {
+                            "min": min_val,
+                            "max": max_val,
+                            "avg": avg_val,
+                            "count": count_val,
+                            "null_count": null_count
+                        }
+                    
+                        # Format for display
+                        schema_info.append(f"- {column_name}:")
+                        schema_info.append(f"    Min: {min_val}, Max: {max_val}, Avg: {round(avg_val, 2) if avg_val is not None else 'N/A'}")
+                        schema_info.append(f"    Non-null values: {count_val}, Null values: {null_count}")
+                except Exception as stats_err:
+                    logger.warning(f"Error collecting numeric statistics: {str(stats_err)}")
+                    schema_info.append("Could not collect numeric column statistics")
+        
+            # Add sample queries
+            schema_info.append(f"\nSample Queries:")
+            schema_info.append(f"- SELECT TOP 5 * FROM {FULLY_QUALIFIED_TABLE_NAME}")
+            schema_info.append(f"- SELECT COUNT(*) FROM {FULLY_QUALIFIED_TABLE_NAME}")
+        
+            # If primary key exists, add a sample query using it
+            if pk_columns:
+                pk_conditions = " AND ".join([f"{pk} = @value" for pk in pk_columns])
+                schema_info.append(f"- SELECT * FROM {FULLY_QUALIFIED_TABLE_NAME} WHERE {pk_conditions}")
+        
+            # Add sample data if available
+            try:
+                if sample_rows is None:
+                    schema_info.append("\nCould not retrieve sample data.")
+                elif sample_rows and sample_description:
+                    column_names = [column[0] for column in sample_description]
                 
-                for row in sample_rows:
-                    # Convert row to list for tabulate
-                    processed_row = []
-                    for item in row:
-                        if isinstance(item, (datetime, bytes, bytearray)):
-                            processed_row.append(str(item))
-                        else:
-                            processed_row.append(item)
-                    table_data.append(processed_row)
+                    schema_info.append("\nSample Data Preview:")
+                    headers = column_names
+                    # Convert rows to lists for tabulate with the converter for this result shape
+                    table_data = convert_rows(sample_rows, row_converter(sample_description))
                 
-                table_str = tabulate.tabulate(table_data, headers=headers, tablefmt="grid")
-                schema_info.append(table_str)
+                    table_str = tabulate.tabulate(table_data, headers=headers, tablefmt="grid")
+                    schema_info.append(table_str)
                 
-                # Add schema information about the sample data
-                schema_dict["sample_data"] = {
-                    "columns": headers,
-                    "rows": [[serialize_value(item) for item in row] for row in sample_rows]
-                }
-            else:
-                schema_info.append("\nNo sample data available.")
-        except Exception as e:
-            logger.warning(f"Could not retrieve sample data: {str(e)}")
-            schema_info.append("\nCould not retrieve sample data.")
+                    # Add schema information about the sample data
+                    schema_dict["sample_data"] = {
+                        "columns": headers,
+                        "rows": table_data  # already JSON-safe from the column converters
+                    }
+                else:
+                    schema_info.append("\nNo sample data available.")
+            except Exception as e:
+                logger.warning(f"Could not retrieve sample data: {str(e)}")
+                schema_info.append("\nCould not retrieve sample data.")
         
-        logger.info("Successfully retrieved table schema information")
-        return "\n".join(schema_info)
+            logger.info("Successfully retrieved table schema information")
+            schema_text = "\n".join(schema_info)
+            if version is not None:
+                now = time.monotonic()
+                _SCHEMA_CACHE[cache_key] = (version, now, schema_text, schema_dict, now)
+            return schema_text
     except pyodbc.Error as e:
         error_msg = f"ODBC Error retrieving schema: {str(e)}"
         logger.error(error_msg)
-        error_details = f"""
-Database connection error details:
-- Error: {str(e)}
-- Server: {MSSQL_SERVER}
-- Database: {MSSQL_DATABASE}
-- Table: {FULLY_QUALIFIED_TABLE_NAME}
-- Username: {MSSQL_USERNAME}
-- Driver: {MSSQL_DRIVER}
-
-Please check your connection settings in the .env file and ensure you have access to the specified table.
-"""
-        return error_details
+        return f"\nDatabase connection error details:\n- Error: {str(e)}{_CONNECTION_ERROR_DETAILS}"
     except Exception as e:
         error_msg = f"Unexpected error retrieving schema: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return f"Error retrieving schema: {str(e)}\n\nCheck server logs for detailed stack trace."
-    finally:
-        if 'conn' in locals():
-            logger.debug("Closing database connection")
-            conn.close()
+
+@mcp.tool()
+def refresh_schema() -> str:
+    """Discard the cached schema so the next get_table_schema call rebuilds it."""
+    global _TABLE_OBJECT_ID
+    _SCHEMA_CACHE.pop((MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME), None)
+    _TABLE_OBJECT_ID = None
+    logger.info(f"Schema cache cleared for table {FULLY_QUALIFIED_TABLE_NAME}")
+    return f"Schema cache cleared for {FULLY_QUALIFIED_TABLE_NAME}. The next get_table_schema call will reload it."
+
+# Per-column converters keyed by the Python type pyodbc reports in cursor.description.
+# Columns of any other type fall back to serialize_value.
+_COLUMN_CONVERTERS = {
+    int: _identity,
+    str: _identity,
+    bool: _identity,
+    float: _finite_float,
+    datetime: _to_str,
+    bytes: _to_str,
+    bytearray: _to_str,
+    Decimal: _to_str,
+    uuid.UUID: _to_str,
+}
+
+@lru_cache(maxsize=128)
+def _build_row_converter(type_codes):
+    # Generate a straight-line function for this result shape: pass-through columns
+    # are copied as row[i] and the rest call their converter directly
+    cells = []
+    namespace = {}
+    for i, type_code in enumerate(type_codes):
+        converter = _COLUMN_CONVERTERS.get(type_code, serialize_value)
+        if converter is _identity:
+            cells.append(f"row[{i}]")
+        else:
+            namespace[f"convert_{i}"] = converter
+            cells.append(f"convert_{i}(row[{i}])")
+    if not namespace:
+        return None
+    exec(f"def convert_row(row):\n    return [{', '.join(cells)}]", namespace)
+    return namespace["convert_row"]
+
+def row_converter(description):
+    """Return a function converting one row to a JSON-safe list, based on cursor.description.
+    
+    Converters are cached per tuple of column types. Returns None when every
+    column can be passed through unchanged.
+    """
+    return _build_row_converter(tuple(column[1] for column in description))
+
+def convert_rows(rows, converter):
+    """Apply a row converter to a batch of rows, returning lists."""
+    if converter is None:
+        return [list(row) for row in rows]
+    return list(map(converter, rows))
+
+def _grid_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return format(value, "g")
+    return str(value).replace("\n", " ")
+
+def render_grid(rows, headers):
+    """Render rows in tabulate's "grid" layout without its per-cell type inference.
+    
+    Columns holding only ints/floats are right-aligned, everything else is
+    left-aligned. Unlike tabulate, numbers are not decimal-aligned and
+    multi-line values are flattened onto one line.
+    """
+    text_rows = [[_grid_cell(value) for value in row] for row in rows]
+    headers = [str(header) for header in headers]
+    widths = [max(map(len, column)) for column in zip(headers, *text_rows)]
+    right_align = [
+        all(type(value) in (int, float) for value in column if value is not None)
+        for column in zip(*rows)
+    ] or [False] * len(headers)
+    
+    def line(cells):
+        return "| " + " | ".join(
+            cell.rjust(width) if right else cell.ljust(width)
+            for cell, width, right in zip(cells, widths, right_align)
+        ) + " |"
+    
+    border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+    lines = [border, line(headers), border.replace("-", "=")]
+    for cells in text_rows:
+        lines.append(line(cells))
+        lines.append(border)
+    return "\n".join(lines)
+
+def dump_json_data(headers, rows, truncated=False):
+    """Serialize already-processed result rows for the JSON_DATA section.
+    
+    The default "records" layout is a list of {column: value} objects; when
+    the row limit was hit it is wrapped as {"records": [...], "truncated": true}
+    so the flag isn't lost. The "columnar" layout ({"columns": [...],
+    "rows": [[...], ...]}) skips the per-row dict construction and is much
+    smaller for wide tables; it always carries the "truncated" flag.
+    """
+    if JSON_DATA_FORMAT == "columnar":
+        payload = {"columns": headers, "rows": rows, "truncated": truncated}
+    else:
+        payload = [dict(zip(headers, row)) for row in rows]
+        if truncated:
+            payload = {"records": payload, "truncated": True}
+    return dumps_json(payload)
+
+def dumps_json(payload, as_bytes=False):
+    """Compact JSON text for payload, via orjson when it is installed.
+    
+    Unsupported objects are converted with str(); datetimes are passed to
+    str() as well so both encoders produce the same text for them. With
+    as_bytes=True the result may be UTF-8 bytes (orjson's native output)
+    instead of str, for callers that write it straight to a file.
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(payload, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+            return data if as_bytes else data.decode()
+        except TypeError:
+            # e.g. integers outside the 64-bit range; stdlib json handles those
+            pass
+    return json.dumps(payload, default=str, separators=(",", ":"))
+
+def loads_json(text):
+    """Parse JSON text, via orjson when it is installed.
+    
+    Falls back to the stdlib parser, which also accepts the NaN/Infinity
+    tokens orjson rejects. Raises ValueError if neither can parse it.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+def fetch_limited_rows(cursor, limit):
+    """Fetch serialized rows in batches, stopping once more than `limit` rows were read.
+    
+    Returns a (rows, truncated) tuple; rows never exceeds `limit` when it is positive.
+    """
+    cursor.arraysize = FETCH_BATCH_SIZE
+    converter = row_converter(cursor.description)
+    rows = []
+    while limit <= 0 or len(rows) <= limit:
+        # Never read past the one extra row that signals truncation
+        size = FETCH_BATCH_SIZE if limit <= 0 else min(FETCH_BATCH_SIZE, limit + 1 - len(rows))
+        batch = cursor.fetchmany(size)
+        if not batch:
+            break
+        rows.extend(convert_rows(batch, converter))
+    
+    truncated = 0 < limit < len(rows)
+    if truncated:
+        del rows[limit:]
+    return rows, truncated
+
+# Arithmetic and aggregate/conversion calls that mark a query as a calculation
+_CALC_RE = re.compile(r' / |[*+-]|(?:AVG|SUM|COUNT|CAST|CONVERT)\(', re.IGNORECASE)
+
+# DATEDIFF(unit, start, end) calls that query_table guards against negative results
+_DATE_CALC_RE = re.compile(r'DATEDIFF\s*\(\s*\w+\s*,\s*(\w+)\s*,\s*(\w+)\s*\)', re.IGNORECASE)
+
+@lru_cache(maxsize=256)
+def date_diff_pattern(start_col, end_col):
+    """Compiled pattern matching DATEDIFF(unit, start_col, end_col), cached per column pair."""
+    return re.compile(rf'DATEDIFF\s*\(\s*\w+\s*,\s*{start_col}\s*,\s*{end_col}\s*\)', re.IGNORECASE)
+
+# Tokenizer for the query_table security check: comments, string literals and
+# whitespace are skipped; identifiers may be [bracketed], "quoted" or dotted
+_SQL_IDENTIFIER = r'(?:\[[^\]]*\]|"[^"]*"|[A-Za-z_@#][\w@#$]*)'
+_SQL_TOKEN_RE = re.compile(
+    r"(?P<skip>--[^\n]*|/\*.*?(?:\*/|\Z)|N?'(?:[^']|'')*(?:'|\Z)|\s+)"
+    rf"|(?P<name>{_SQL_IDENTIFIER}(?:\s*\.\s*{_SQL_IDENTIFIER})*)"
+    r"|(?P<punct>[(),;])"
+    r"|(?P<other>.)",
+    re.DOTALL
+)
+_SQL_DOT_RE = re.compile(r'\s*\.\s*')
+_SQL_QUOTE_CHARS = str.maketrans("", "", '[]"')
+
+def iter_sql_tokens(sql):
+    """Yield upper-cased keywords and identifiers, plus ( ) , ; punctuation, from a SQL string.
+    
+    Quoting is removed from identifiers and dotted names are returned whole,
+    so "[dbo].[Orders]" yields "DBO.ORDERS".
+    """
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind == "name":
+            yield _SQL_DOT_RE.sub(".", match.group()).translate(_SQL_QUOTE_CHARS).upper()
+        elif kind == "punct":
+            yield match.group()
+
+# Keywords that are followed by a table reference
+_TABLE_KEYWORDS = frozenset({
+    "FROM", "JOIN", "APPLY", "INTO", "UPDATE", "DELETE", "INSERT", "MERGE", "USING", "TABLE",
+})
+# Statements whose TABLE keyword names a table (unlike DECLARE @t TABLE or a [Table] column)
+_TABLE_DDL_KEYWORDS = frozenset({"CREATE", "ALTER", "DROP", "TRUNCATE"})
+# Keywords that can follow a table reference and must not be mistaken for an alias
+_CLAUSE_KEYWORDS = frozenset({
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "APPLY", "ON",
+    "GROUP", "ORDER", "HAVING", "SET", "UNION", "EXCEPT", "INTERSECT", "OPTION", "WITH",
+    "OUTPUT", "VALUES", "SELECT", "DEFAULT", "PIVOT", "UNPIVOT", "FOR", "USING", "WHEN",
+    "TABLESAMPLE", "AS",
+})
+# Keywords that end a FROM clause's comma-separated table list
+_FROM_END_KEYWORDS = frozenset({
+    "WHERE", "GROUP", "ORDER", "HAVING", "UNION", "EXCEPT", "INTERSECT", "OPTION", "FOR",
+    "WINDOW", "OUTPUT", "WHEN", "THEN", "ELSE", "END",
+})
+# Keywords that start a new statement, ending the scope of any CTEs before them
+_STATEMENT_KEYWORDS = frozenset({
+    "SELECT", "INSERT", "UPDATE", "DELETE", "MERGE", "WITH", "DECLARE", "SET", "EXEC",
+    "EXECUTE", "IF", "WHILE", "BEGIN", "TRUNCATE", "CREATE", "ALTER", "DROP", "USE",
+    "PRINT", "RETURN", "GRANT", "REVOKE", "DENY",
+})
+# Dynamic SQL and remote rowsets can reach any table through a string, so they are refused outright
+_DYNAMIC_SQL_NAMES = frozenset({
+    "EXEC", "EXECUTE", "SP_EXECUTESQL", "OPENROWSET", "OPENQUERY", "OPENDATASOURCE",
+})
+
+def is_allowed_table(name):
+    """Check whether an upper-cased table token refers to the configured table.
+    
+    Other databases and linked servers are refused. Temporary tables and table
+    variables are session-local, so they are allowed too.
+    """
+    return name in _ALLOWED_TABLE_REFS or name[0] in "#@"
+
+def find_disallowed_tables(tokens):
+    """Return table names referenced by FROM/JOIN/APPLY/INTO/UPDATE/DELETE/INSERT/MERGE/USING
+    or CREATE/ALTER/DROP/TRUNCATE TABLE that aren't allowed.
+    
+    Subqueries are skipped (their own FROM is checked), CTE names are accepted
+    within the statement that declares them, UPDATE/DELETE may target an alias
+    of the allowed table, and every table of a comma-separated FROM list is
+    checked, past aliases, table hints and FOR SYSTEM_TIME. A FROM inside a
+    function call or after IS [NOT] DISTINCT is not a table reference. EXEC,
+    sp_executesql and the OPEN* rowset functions are always reported, since
+    their SQL is hidden in strings.
+    """
+    n = len(tokens)
+    
+    def is_name(token):
+        return token not in "(),;"
+    
+    def alias_end(i):
+        # Skip an optional "[AS] alias" after a table reference
+        if i < n and tokens[i] == "AS":
+            i += 1
+        if i < n and is_name(tokens[i]) and tokens[i] not in _CLAUSE_KEYWORDS:
+            i += 1
+        return i
+    
+    def group_end(i):
+        # Index just past the parenthesized group opening at tokens[i]
+        depth = 0
+        while i < n:
+            if tokens[i] == "(":
+                depth += 1
+            elif tokens[i] == ")":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return n
+    
+    def statement_end(i):
+        # End of the statement whose main verb is tokens[i]; MERGE must end with ";"
+        verb = tokens[i]
+        select_allowed = verb == "INSERT"
+        i += 1
+        while i < n:
+            token = tokens[i]
+            if token == "(":
+                i = group_end(i)
+                continue
+            if token in ";)":
+                return i
+            if verb != "MERGE":
+                if token == "SELECT":
+                    if tokens[i - 1] in ("UNION", "ALL", "EXCEPT", "INTERSECT") or select_allowed:
+                        select_allowed = False
+                    else:
+                        return i
+                elif token == "WITH":
+                    if i + 1 < n and tokens[i + 1] != "(":
+                        return i
+                elif token in _STATEMENT_KEYWORDS and not (verb == "UPDATE" and token == "SET"):
+                    return i
+            i += 1
+        return n
+    
+    # CTE names: "name AS (" or "name (columns) AS (", each visible from its
+    # definition to the end of the statement that follows the WITH list
+    ctes = []
+    for i in range(1, n - 1):
+        if tokens[i] == "AS" and tokens[i + 1] == "(":
+            j = i - 1
+            if tokens[j] == ")":
+                while j > 0 and tokens[j] != "(":
+                    j -= 1
+                j -= 1
+            if j >= 0 and is_name(tokens[j]):
+                # Skip the remaining definitions to find the main statement
+                k = group_end(i + 1)
+                while k < n and tokens[k] == ",":
+                    while k + 1 < n and not (tokens[k] == "AS" and tokens[k + 1] == "("):
+                        k += 1
+                    k = group_end(k + 1)
+                end = statement_end(k) if k < n and is_name(tokens[k]) else k
+                ctes.append((tokens[j], j, end))
+    
+    def is_cte(name, i):
+        return any(name == cte and start <= i < end for cte, start, end in ctes)
+    
+    # Aliases given to the allowed table, e.g. UPDATE o SET ... FROM dbo.Orders o
+    aliases = set()
+    for i, token in enumerate(tokens):
+        if is_name(token) and is_allowed_table(token):
+            end = alias_end(i + 1)
+            if end > i + 1 and tokens[end - 1] != "AS":
+                aliases.add(tokens[end - 1])
+    
+    # Whether each token's innermost parenthesized group is a query; any other
+    # group is a function call such as TRIM(' ' FROM name)
+    in_query = []
+    groups = [True]
+    for token in tokens:
+        if token == "(":
+            groups.append(False)
+        elif token == ")" and len(groups) > 1:
+            groups.pop()
+        elif token == "SELECT":
+            groups[-1] = True
+        in_query.append(groups[-1])
+    
+    def check(name, i, alias_ok=False):
+        if not (is_allowed_table(name) or is_cte(name, i) or (alias_ok and name in aliases)):
+            disallowed.append(name)
+    
+    disallowed = []
+    for i, token in enumerate(tokens):
+        if is_name(token) and token.rsplit(".", 1)[-1] in _DYNAMIC_SQL_NAMES:
+            disallowed.append(token)
+            continue
+        if token not in _TABLE_KEYWORDS:
+            continue
+        j = i + 1
+        previous = tokens[i - 1] if i else None
+        if token == "FROM" and (
+            not in_query[i]
+            or previous == "SYSTEM_TIME"
+            or (previous == "DISTINCT" and tokens[i - 2:i - 1] in (["IS"], ["NOT"]))
+        ):
+            # TRIM(' ' FROM name), FOR SYSTEM_TIME FROM start TO end, a IS [NOT] DISTINCT FROM b
+            continue
+        if token == "TABLE":
+            if previous not in _TABLE_DDL_KEYWORDS:
+                continue
+            if tokens[j:j + 2] == ["IF", "EXISTS"]:
+                j += 2
+        if token in ("DELETE", "INSERT", "MERGE"):
+            # DELETE/INSERT/MERGE [TOP (n)] [FROM|INTO] target; a following FROM/INTO is checked on its own
+            if j < n and tokens[j] == "TOP":
+                j = group_end(j + 1)
+            if j < n and tokens[j] in ("FROM", "INTO"):
+                continue
+        if token in ("UPDATE", "DELETE", "INSERT") and previous == "THEN":
+            # MERGE ... THEN UPDATE SET / DELETE / INSERT acts on the MERGE target
+            continue
+        if j < n and is_name(tokens[j]):
+            check(tokens[j], j, alias_ok=token in ("UPDATE", "DELETE"))
+        if token == "TABLE":
+            # DROP TABLE a, b
+            while j + 2 < n and tokens[j + 1] == "," and is_name(tokens[j + 2]):
+                j += 2
+                check(tokens[j], j)
+            continue
+        if token != "FROM":
+            continue
+        # Every table after a top-level comma in the FROM clause, whatever aliases,
+        # hints (WITH (NOLOCK), TABLESAMPLE (...)) or ON conditions come between
+        j += 1
+        while j < n:
+            token = tokens[j]
+            if token == "(":
+                j = group_end(j)
+                continue
+            if token == "FOR" and tokens[j + 1:j + 2] == ["SYSTEM_TIME"]:
+                # A temporal table clause, not FOR XML/JSON/BROWSE
+                j += 2
+                continue
+            if token in ";)" or token in _FROM_END_KEYWORDS or (token in _STATEMENT_KEYWORDS and token != "WITH"):
+                break
+            if token == "," and j + 1 < n and is_name(tokens[j + 1]):
+                check(tokens[j + 1], j + 1)
+            j += 1
+    return disallowed
+
+@lru_cache(maxsize=256)
+def analyze_sql(sql):
+    """Tokenize a statement once, returning (set of tokens, tuple of disallowed tables).
+    
+    Cached per statement text since clients often retry or repeat the same query.
+    """
+    tokens = list(iter_sql_tokens(sql))
+    return frozenset(tokens), tuple(find_disallowed_tables(tokens))
+
+def skip_leading_sql_trivia(sql, i=0):
+    """Return the index of the first character that is not whitespace or a comment."""
+    n = len(sql)
+    while i < n:
+        if sql[i].isspace():
+            i += 1
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = n if end == -1 else end + 1
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        else:
+            break
+    return i
 
 def is_select_query(sql):
     """Check if a query is a SELECT statement (read-only)"""
-    # Remove comments and normalize whitespace
-    sql = re.sub(r'--.*?(\n|$)|/\*.*?\*/', ' ', sql, flags=re.DOTALL)
-    sql = ' '.join(sql.split()).strip().upper()
+    # Only the first real token matters, so scan past leading whitespace/comments
+    i = skip_leading_sql_trivia(sql)
+    if sql[i:i + 6].lower() != 'select':
+        return False
+    # Reject identifiers that merely start with SELECT (e.g. SELECTOR)
+    return i + 6 == len(sql) or not (sql[i + 6].isalnum() or sql[i + 6] in '_@#$')
+
+_SELECT_MODIFIER_RE = re.compile(r'(?:ALL|DISTINCT)\b', re.IGNORECASE)
+
+def add_row_limit(sql):
+    """Insert a parameterized TOP (?) after the leading SELECT [ALL|DISTINCT] of a query.
     
-    # Check if it starts with SELECT
-    return sql.startswith('SELECT')
+    Comments between SELECT and the modifier are skipped, so TOP never lands before DISTINCT.
+    """
+    i = skip_leading_sql_trivia(sql) + 6
+    modifier = _SELECT_MODIFIER_RE.match(sql, skip_leading_sql_trivia(sql, i))
+    if modifier:
+        i = modifier.end()
+    return f"{sql[:i]} TOP (?){sql[i:]}"
 
 @mcp.tool()
-def query_table(sql: str) -> str:
-    """Execute SQL queries on the specific table and return results in tabular format."""
-    logger.info(f"Processing query for table {FULLY_QUALIFIED_TABLE_NAME}...")
+def query_table(sql: str, limit: int = QUERY_ROW_LIMIT) -> str:
+    """Execute SQL queries on the specific table and return results in tabular format.
     
-    # Security check: ensure query only accesses the allowed table
-    sql_upper = sql.upper()
-    table_reference = FULLY_QUALIFIED_TABLE_NAME.upper()
-    table_name_only = MSSQL_TABLE_NAME.upper()
+    Args:
+        sql: The T-SQL statement to execute
+        limit: Maximum number of rows to return for SELECT queries (0 for no limit)
+    """
+    logger.info(f"Processing query for table {FULLY_QUALIFIED_TABLE_NAME}...")
     
-    # Check if the query references tables other than the allowed one
-    if "FROM" in sql_upper or "JOIN" in sql_upper or "INTO" in sql_upper or "UPDATE" in sql_upper:
-        if table_reference not in sql_upper and table_name_only not in sql_upper:
-            error_msg = f"Security error: Query must reference only the allowed table: {FULLY_QUALIFIED_TABLE_NAME}"
-            logger.warning(error_msg)
-            return f"Error: {error_msg}"
+    # Security check: ensure query only accesses the allowed table. Tokens skip
+    # comments and string literals, so "-- FROM x" or 'FROM' in a value can't trip
+    # it; dynamic SQL, which could hide a table in a string, is refused instead.
+    token_set, disallowed = analyze_sql(sql)
+    if disallowed:
+        error_msg = f"Security error: Query must reference only the allowed table: {FULLY_QUALIFIED_TABLE_NAME}"
+        logger.warning(f"{error_msg} (found: {', '.join(disallowed)})")
+        return f"Error: {error_msg}"
     
-    # Check for date calculations that might produce negative results
-    date_calc_pattern = r'DATEDIFF\s*\(\s*\w+\s*,\s*(\w+)\s*,\s*(\w+)\s*\)'
-    date_calculations = re.findall(date_calc_pattern, sql, re.IGNORECASE)
+    # Check for date calculations that might produce negative results; the token set
+    # is already upper-cased, so most queries skip the case-insensitive regex scan
+    warning_msg = None
+    date_calculations = _DATE_CALC_RE.findall(sql) if "DATEDIFF" in token_set else []
     
     # Modify query to handle potential date calculation issues
-    if date_calculations and 'ABS(' not in sql_upper and 'CASE WHEN' not in sql_upper:
+    if date_calculations and "ABS" not in token_set and "CASE" not in token_set:
         logger.info("Detected potential date calculation issue - suggesting modification")
         for start_col, end_col in date_calculations:
             # Create safer pattern for replacement
-            pattern = rf'DATEDIFF\s*\(\s*\w+\s*,\s*{start_col}\s*,\s*{end_col}\s*\)'
             replacement = f'CASE WHEN {end_col} >= {start_col} THEN DATEDIFF(DAY, {start_col}, {end_col}) ELSE NULL END'
             
             # Check if we can safely modify the query
-            if re.search(pattern, sql):
-                modified_sql = re.sub(pattern, replacement, sql)
+            modified_sql, replaced = date_diff_pattern(start_col, end_col).subn(replacement, sql)
+            if replaced:
                 logger.info(f"Modified query to prevent negative date calculations: {modified_sql}")
                 
                 # Add a warning to the query results
@@ -471,98 +1245,81 @@ def query_table(sql: str) -> str:
                 )
                 sql = modified_sql
     
-    # Check if this is a calculation query (likely to produce percentages or other float values)
-    has_calculation = False
-    if any(op in sql_upper for op in [' / ', '*', '+', '-', 'AVG(', 'SUM(', 'COUNT(', 'CAST(', 'CONVERT(']):
-        has_calculation = True
-        logger.debug("Query contains calculations - special handling will be applied")
+    # Check if this is a calculation query (likely to produce percentages or other float values).
+    # Only logged at DEBUG, so skip the scan unless MCP_TRACE enabled the DEBUG sink.
+    if MCP_TRACE and _CALC_RE.search(sql):
+        logger.debug("Query contains calculations - float values will be serialized safely")
+    
+    # Let the server stop early for plain SELECTs; one extra row reveals truncation.
+    # TOP would bind to the first branch of a UNION/EXCEPT/INTERSECT, ahead of the
+    # ORDER BY, so those are only cut on the client side.
+    params = ()
+    if limit > 0 and is_select_query(sql) and not token_set & {"TOP", "OFFSET", "INTO", "UNION", "EXCEPT", "INTERSECT"}:
+        sql = add_row_limit(sql)
+        params = (limit + 1,)
     
-    conn = None
     try:
-        conn = pyodbc.connect(connection_string)
-        cursor = conn.cursor()
-        cursor.execute(sql)
+        with get_query_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, *params)
         
-        # For SELECT queries, format results as tabular data
-        if cursor.description is not None:
-            results = cursor.fetchall()
+            # For SELECT queries, format results as tabular data
+            if cursor.description is not None:
+                # Fetch in batches and stop at the row limit (handles datetime, bytes, NaN, etc.)
+                rows, truncated = fetch_limited_rows(cursor, limit)
             
-            if not results:
-                if is_select_query(sql):
-                    return "Query executed successfully, but no rows were returned."
-                else:
-                    return "SQL executed successfully, no results to display."
-            
-            # Get column names from cursor description
-            headers = [column[0] for column in cursor.description]
+                if not rows:
+                    if is_select_query(sql):
+                        return "Query executed successfully, but no rows were returned."
+                    else:
+                        return "SQL executed successfully, no results to display."
             
-            # Process row data (handle datetime, bytes, etc.)
-            rows = []
-            for row in results:
-                processed_row = []
-                for item in row:
-                    # Special handling for float values from calculations
-                    processed_row.append(serialize_value(item))
-                rows.append(processed_row)
+                # Get column names from cursor description
+                headers = [column[0] for column in cursor.description]
             
-            # Create tabular output using tabulate
-            table = tabulate.tabulate(rows, headers=headers, tablefmt="grid")
+                # Create tabular output using tabulate, capped to keep large results cheap
+                shown = rows[:MAX_RENDER_ROWS]
+                if len(shown) > TABULATE_MAX_ROWS:
+                    table = render_grid(shown, headers)
+                else:
+                    table = tabulate.tabulate(shown, headers=headers, tablefmt="grid")
+                if len(rows) > MAX_RENDER_ROWS:
+                    table += f"\n... {len(rows) - MAX_RENDER_ROWS} more rows not shown (see JSON_DATA)"
             
-            # Prepare JSON data with special handling for float values
-            json_data = []
-            for row in rows:
-                json_row = {}
-                for i, header in enumerate(headers):
-                    json_row[header] = row[i]
-                json_data.append(json_row)
+                # Return combined output that's both human-readable and machine-parseable
+                output = f"Query executed successfully. {len(rows)} rows returned.\n\n{table}\n\n"
             
-            # Return combined output that's both human-readable and machine-parseable
-            output = f"Query executed successfully. {len(rows)} rows returned.\n\n{table}\n\n"
+                if truncated:
+                    output = (
+                        f"NOTICE: Results were truncated to the first {limit} rows. "
+                        "Add filters or aggregation to narrow the result set, or pass a larger limit.\n\n"
+                    ) + output
             
-            # If warning message exists from date calculation adjustment, add it
-            if 'warning_msg' in locals():
-                output = f"{warning_msg}\n\n{output}"
+                # If warning message exists from date calculation adjustment, add it
+                if warning_msg:
+                    output = f"{warning_msg}\n\n{output}"
             
-            # If this is a calculation query, use custom JSON serialization to handle floats properly
-            if has_calculation:
-                try:
-                    # Use a custom JSON encoder to handle special float values
-                    class CustomJSONEncoder(json.JSONEncoder):
-                        def default(self, obj):
-                            return serialize_value(obj)
-                    
-                    json_str = json.dumps(json_data, cls=CustomJSONEncoder)
-                    output += "JSON_DATA:" + json_str
-                except Exception as json_err:
-                    logger.error(f"JSON serialization error: {json_err}")
-                    # Fallback: convert problematic values to strings
-                    for row_data in json_data:
-                        for key, value in row_data.items():
-                            if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
-                                row_data[key] = str(value)
-                    
-                    output += "JSON_DATA:" + json.dumps(json_data)
-            else:
-                # Standard serialization for non-calculation queries
-                output += "JSON_DATA:" + json.dumps(json_data)
+                # Values are already serialized, so special floats can't break json.dumps here
+                output += "JSON_DATA:" + dump_json_data(headers, rows, truncated)
             
-            return output
-        else:
-            # For non-SELECT queries
-            row_count = cursor.rowcount
-            if row_count >= 0:
-                output = f"SQL executed successfully. {row_count} rows affected."
+                return output
             else:
-                output = "SQL executed successfully."
+                # For non-SELECT queries
+                row_count = cursor.rowcount
+                if row_count >= 0:
+                    output = f"SQL executed successfully. {row_count} rows affected."
+                else:
+                    output = "SQL executed successfully."
             
-            conn.commit()
-            return output
+                # Surface errors from later statements of the batch before committing;
+                # if one raises, get_query_conn rolls the whole batch back
+                while cursor.nextset():
+                    pass
+                conn.commit()
+                return output
     except Exception as e:
         logger.error(f"Error executing query: {str(e)}", exc_info=True)
         return f"Error: {str(e)}"
-    finally:
-        if conn:
-            conn.close()
 
 @mcp.prompt()
 def example_prompt(code: str) -> str:
@@ -573,47 +1330,42 @@ def get_table_info() -> str:
     """Get basic table information when schema retrieval fails."""
     logger.info(f"Attempting to retrieve basic table information for {FULLY_QUALIFIED_TABLE_NAME}...")
     try:
-        conn = pyodbc.connect(connection_string)
-        cursor = conn.cursor()
+        with get_conn() as conn:
+            cursor = conn.cursor()
         
-        info = []
-        info.append(f"Server: {MSSQL_SERVER}")
-        info.append(f"Database: {MSSQL_DATABASE}")
-        info.append(f"Table: {FULLY_QUALIFIED_TABLE_NAME}")
+            info = []
+            info.append(f"Server: {MSSQL_SERVER}")
+            info.append(f"Database: {MSSQL_DATABASE}")
+            info.append(f"Table: {FULLY_QUALIFIED_TABLE_NAME}")
         
-        # Attempt to get row count 
-        try:
-            cursor.execute(f"SELECT COUNT(*) FROM {FULLY_QUALIFIED_TABLE_NAME}")
-            row_count = cursor.fetchone()[0]
-            info.append(f"Row count: {row_count}")
-        except Exception as e:
-            logger.error(f"Error getting row count: {e}")
-            info.append("Row count: Unable to retrieve")
+            # Attempt to get row count 
+            try:
+                cursor.execute(_ROW_COUNT_QUERY, _table_object_id(cursor))
+                row_count = cursor.fetchone()[0]
+                if row_count is None:
+                    raise ValueError("table not found in sys.partitions")
+                info.append(f"Approximate row count: {row_count}")
+            except Exception as e:
+                logger.error(f"Error getting row count: {e}")
+                info.append("Row count: Unable to retrieve")
             
-        # Attempt to verify table existence
-        try:
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
+            # Attempt to verify table existence
+            try:
+                cursor.execute(_TABLE_EXISTS_QUERY, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
             
-            table_exists = cursor.fetchone()[0] > 0
-            if table_exists:
-                info.append("Table exists: Yes")
-            else:
-                info.append("Table exists: No - Table not found in INFORMATION_SCHEMA.TABLES")
-        except Exception as e:
-            logger.error(f"Error verifying table existence: {e}")
-            info.append("Table exists: Unable to verify")
+                table_exists = cursor.fetchone()[0] > 0
+                if table_exists:
+                    info.append("Table exists: Yes")
+                else:
+                    info.append("Table exists: No - Table not found in INFORMATION_SCHEMA.TABLES")
+            except Exception as e:
+                logger.error(f"Error verifying table existence: {e}")
+                info.append("Table exists: Unable to verify")
         
-        return "\n".join(info)
+            return "\n".join(info)
     except Exception as e:
         logger.error(f"Error getting basic table info: {str(e)}", exc_info=True)
         return f"Error retrieving basic table information: {str(e)}"
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @mcp.tool()
 def diagnose_table_access() -> str:
@@ -623,141 +1375,103 @@ def diagnose_table_access() -> str:
     
     # Test database connection
     try:
-        conn = pyodbc.connect(connection_string)
-        cursor = conn.cursor()
-        results.append("✅ Database connection: Success")
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            # A pooled connection may predate an outage, so prove the link with a round trip
+            cursor.execute("SELECT 1").fetchone()
+            results.append("✅ Database connection: Success")
         
-        # Test table existence
-        try:
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
+            # Table existence and permissions come back as two result sets of one batch
+            try:
+                cursor.execute(_DIAGNOSTICS_BATCH, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME, QUOTED_TABLE_NAME))
             
-            table_exists = cursor.fetchone()[0] > 0
-            if table_exists:
-                results.append(f"✅ Table exists: {FULLY_QUALIFIED_TABLE_NAME} found")
-            else:
-                results.append(f"❌ Table missing: {FULLY_QUALIFIED_TABLE_NAME} not found in INFORMATION_SCHEMA.TABLES")
-                results.append("   ↳ Check if table name and schema are correct")
-                results.append("   ↳ Verify user has permission to see the table metadata")
+                table_exists = cursor.fetchone()[0] > 0
+                if table_exists:
+                    results.append(f"✅ Table exists: {FULLY_QUALIFIED_TABLE_NAME} found")
+                else:
+                    results.append(f"❌ Table missing: {FULLY_QUALIFIED_TABLE_NAME} not found in INFORMATION_SCHEMA.TABLES")
+                    results.append("   ↳ Check if table name and schema are correct")
+                    results.append("   ↳ Verify user has permission to see the table metadata")
+                    return "\n".join(results)
+            except Exception as e:
+                results.append(f"❌ Table check failed: {str(e)}")
                 return "\n".join(results)
-        except Exception as e:
-            results.append(f"❌ Table check failed: {str(e)}")
-            return "\n".join(results)
         
-        # Test SELECT permission
-        try:
-            cursor.execute(f"SELECT TOP 1 * FROM {FULLY_QUALIFIED_TABLE_NAME}")
-            cursor.fetchone()  # Just to test if it works
-            results.append("✅ SELECT permission: Granted")
-        except Exception as e:
-            results.append(f"❌ SELECT permission: Denied - {str(e)}")
-        
-        # Test other permissions (with transaction to avoid actual changes)
-        cursor.execute("BEGIN TRANSACTION")
-        
-        try:
-            # Detect primary key for WHERE clause
-            cursor.execute(f"""
-                SELECT c.COLUMN_NAME, DATA_TYPE
-                FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-                JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE c ON c.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
-                JOIN INFORMATION_SCHEMA.COLUMNS col ON c.COLUMN_NAME = col.COLUMN_NAME 
-                    AND col.TABLE_SCHEMA = tc.TABLE_SCHEMA AND col.TABLE_NAME = tc.TABLE_NAME
-                WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY' 
-                    AND tc.TABLE_SCHEMA = ? 
-                    AND tc.TABLE_NAME = ?
-            """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-            
-            pk_info = cursor.fetchone()
-            
-            # If no PK, get first column for tests
-            if not pk_info:
-                cursor.execute(f"""
-                    SELECT TOP 1 COLUMN_NAME, DATA_TYPE
-                    FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-                    ORDER BY ORDINAL_POSITION
-                """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-                pk_info = cursor.fetchone()
-            
-            if pk_info:
-                column_name, data_type = pk_info
-                
-                # Use appropriate literal format based on data type
-                safe_where = f"1=0"  # Never true condition to avoid affecting data
-                
-                # Test UPDATE permission (will rollback)
-                try:
-                    if data_type in ('varchar', 'nvarchar', 'char', 'nchar'):
-                        test_sql = f"UPDATE {FULLY_QUALIFIED_TABLE_NAME} SET {column_name} = {column_name} WHERE {safe_where}"
-                    else:
-                        test_sql = f"UPDATE {FULLY_QUALIFIED_TABLE_NAME} SET {column_name} = {column_name} WHERE {safe_where}"
-                    
-                    cursor.execute(test_sql)
-                    results.append("✅ UPDATE permission: Granted")
-                except Exception as e:
-                    results.append(f"❌ UPDATE permission: Denied - {str(e)}")
-                
-                # Test DELETE permission (will rollback)
-                try:
-                    cursor.execute(f"DELETE FROM {FULLY_QUALIFIED_TABLE_NAME} WHERE {safe_where}")
-                    results.append("✅ DELETE permission: Granted")
-                except Exception as e:
-                    results.append(f"❌ DELETE permission: Denied - {str(e)}")
-                
-                # Test INSERT permission (will rollback)
-                try:
-                    columns = []
-                    cursor.execute(f"""
-                        SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE
-                        FROM INFORMATION_SCHEMA.COLUMNS 
-                        WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-                        ORDER BY ORDINAL_POSITION
-                    """, (MSSQL_TABLE_SCHEMA, MSSQL_TABLE_NAME))
-                    
-                    # Build a safe INSERT that will fail on constraints but test permissions
-                    column_list = []
-                    value_list = []
-                    
-                    for col_name, data_type, is_nullable in cursor.fetchall():
-                        if is_nullable == 'YES':
-                            column_list.append(col_name)
-                            value_list.append('NULL')
-                            
-                    if column_list:
-                        insert_sql = f"INSERT INTO {FULLY_QUALIFIED_TABLE_NAME} ({', '.join(column_list)}) VALUES ({', '.join(value_list)})"
-                        try:
-                            cursor.execute(insert_sql)
-                            results.append("✅ INSERT permission: Granted")
-                        except Exception as e:
-                            # Check if it's a constraint error (which means permission was granted)
-                            if "constraint" in str(e).lower() or "null" in str(e).lower():
-                                results.append("✅ INSERT permission: Granted (failed due to constraints)")
-                            else:
-                                results.append(f"❌ INSERT permission: Denied - {str(e)}")
+            # Test SELECT/INSERT/UPDATE/DELETE permissions
+            try:
+                cursor.nextset()
+                granted = {row[0] for row in cursor.fetchall()}
+                for permission in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+                    if permission in granted:
+                        results.append(f"✅ {permission} permission: Granted")
                     else:
-                        results.append("⚠️ INSERT permission: Could not test (no nullable columns found)")
-                except Exception as e:
-                    results.append(f"❌ INSERT permission: Test error - {str(e)}")
-            else:
-                results.append("⚠️ Permissions tests: Limited (no suitable columns found)")
-        except Exception as e:
-            results.append(f"❌ Permissions tests error: {str(e)}")
-        finally:
-            # Always rollback the transaction
-            cursor.execute("ROLLBACK TRANSACTION")
-            results.append("ℹ️ All test changes were rolled back")
+                        results.append(f"❌ {permission} permission: Denied")
+            except Exception as e:
+                results.append(f"❌ Permissions tests error: {str(e)}")
         
-        return "\n".join(results)
+            return "\n".join(results)
     except Exception as e:
         results.append(f"❌ Database connection failed: {str(e)}")
         return "\n".join(results)
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+# Query logs are appended, one JSON record per line, to a single JSONL file by a
+# background thread so save_query_log doesn't block on disk I/O
+QUERY_LOG_DIR = "logs/queries"
+QUERY_LOG_FILE = os.path.join(QUERY_LOG_DIR, "queries.jsonl")
+# Bounded so a stalled disk can't grow memory without limit; when full,
+# save_query_log writes the record itself
+_log_queue = queue.Queue(maxsize=1024)
+# Serializes appends from the writer thread and the synchronous fallback
+_log_write_lock = threading.Lock()
+
+def _encode_log_record(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return data + b"\n"
+
+def _query_log_writer():
+    """Append queued query log records to QUERY_LOG_FILE until a None sentinel is received.
+    
+    Records may be str or UTF-8 bytes. The file stays open between records and
+    is flushed after each one so readers see complete lines.
+    """
+    stream = None
+    while True:
+        data = _log_queue.get()
+        if data is None:
+            break
+        try:
+            with _log_write_lock:
+                if stream is None:
+                    os.makedirs(QUERY_LOG_DIR, exist_ok=True)
+                    stream = open(QUERY_LOG_FILE, 'ab', buffering=1 << 16)
+                stream.write(_encode_log_record(data))
+                stream.flush()
+            logger.debug("Query log appended to {}", QUERY_LOG_FILE)
+        except OSError as e:
+            logger.error(f"Error writing query log {QUERY_LOG_FILE}: {str(e)}")
+    if stream is not None:
+        stream.close()
+
+def _write_query_log_now(data):
+    """Append one record on the calling thread (used when the writer queue is full)."""
+    with _log_write_lock:
+        os.makedirs(QUERY_LOG_DIR, exist_ok=True)
+        with open(QUERY_LOG_FILE, 'ab') as f:
+            f.write(_encode_log_record(data))
+
+_log_writer_thread = threading.Thread(target=_query_log_writer, name="query-log-writer", daemon=True)
+_log_writer_thread.start()
+
+@atexit.register
+def _flush_query_logs():
+    """Let the writer drain pending query logs before the server exits."""
+    try:
+        _log_queue.put(None, timeout=5)
+    except queue.Full:
+        logger.warning("Query log writer is not draining; pending logs may be lost")
+        return
+    _log_writer_thread.join(timeout=5)
 
 @mcp.tool()
 def save_query_log(natural_language_query: str, sql_query: str, result_summary: str, iterations: list) -> str:
@@ -765,38 +1479,26 @@ def save_query_log(natural_language_query: str, sql_query: str, result_summary:
     logger.info(f"Saving query log for: {natural_language_query[:50]}...")
     
     try:
-        log_dir = "logs/queries"
-        os.makedirs(log_dir, exist_ok=True)
-        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = os.path.join(log_dir, f"query_{timestamp}.json")
         
         # Check for calculations in the SQL which might cause serialization issues
-        has_calculation = any(op in sql_query.upper() 
-                           for op in [' / ', '*', '+', '-', 'AVG(', 'SUM(', 'COUNT(', 'CAST(', 'CONVERT('])
+        has_calculation = _CALC_RE.search(sql_query) is not None
         
-        # Extract row count and first few rows from result summary
+        # Split the result summary from its JSON_DATA section
+        summary, _, json_str = result_summary.partition("\n\nJSON_DATA:")
         result_info = {
             "success": not result_summary.startswith("Error"),
-            "summary": result_summary.split("\n\nJSON_DATA:")[0] if "JSON_DATA:" in result_summary else result_summary
+            "summary": summary
         }
         
         # Extract JSON data if available, with special handling for calculations
-        if "JSON_DATA:" in result_summary and not has_calculation:
-            # Standard handling for non-calculation queries
+        if json_str and not has_calculation:
+            # Parsed once and re-encoded with the rest of the record
             try:
-                json_str = result_summary.split("JSON_DATA:")[1]
-                result_info["data"] = json.loads(json_str)
-            except json.JSONDecodeError:
-                # If there's a parsing error, try to sanitize the JSON
-                try:
-                    json_str = result_summary.split("JSON_DATA:")[1].strip()
-                    # Replace problematic values
-                    json_str = json_str.replace('NaN', '"NaN"').replace('Infinity', '"Infinity"').replace('-Infinity', '"-Infinity"')
-                    result_info["data"] = json.loads(json_str)
-                except:
-                    result_info["data"] = "JSON parsing failed - serialization issue with results"
-        elif "JSON_DATA:" in result_summary and has_calculation:
+                result_info["data"] = loads_json(json_str)
+            except ValueError:
+                result_info["data"] = "JSON parsing failed - serialization issue with results"
+        elif json_str and has_calculation:
             # For calculation queries, store a message instead of trying to parse potentially problematic JSON
             result_info["data"] = "JSON data omitted for calculation query to avoid serialization issues"
         
@@ -807,23 +1509,12 @@ def save_query_log(natural_language_query: str, sql_query: str, result_summary:
                 "timestamp": timestamp,
                 "natural_language_query": natural_language_query,
                 "final_sql_query": sql_query,
-                "result": result_info,
-                "iterations": iterations
+                "iterations": iterations,
+                "result": result_info
             }
             
-            # Use a custom encoder that can handle special float values
-            class CustomJSONEncoder(json.JSONEncoder):
-                def default(self, obj):
-                    if isinstance(obj, (datetime, bytes, bytearray)):
-                        return str(obj)
-                    elif isinstance(obj, float):
-                        if math.isnan(obj) or math.isinf(obj):
-                            return str(obj)
-                    return super().default(obj)
-            
-            # Write to file with the custom encoder
-            with open(log_file, 'w') as f:
-                json.dump(log_entry, f, indent=2, cls=CustomJSONEncoder, default=str)
+            # Serialize compactly; datetimes and bytes become strings
+            log_data = dumps_json(log_entry, as_bytes=True)
                 
         except (TypeError, ValueError, OverflowError) as json_err:
             # If serialization fails with custom encoder, create a simplified log entry
@@ -848,16 +1539,69 @@ def save_query_log(natural_language_query: str, sql_query: str, result_summary:
                 ]
             }
             
-            # Try to write the simplified log
-            with open(log_file, 'w') as f:
-                json.dump(simple_log, f, indent=2, default=str)
+            # Fall back to the simplified log
+            log_data = dumps_json(simple_log, as_bytes=True)
         
-        logger.info(f"Query log saved to {log_file}")
-        return f"Query log saved successfully to {log_file}"
+        # Hand the disk write to the background writer so the tool call returns immediately
+        try:
+            _log_queue.put_nowait(log_data)
+            logger.info(f"Query log queued for {QUERY_LOG_FILE}")
+        except queue.Full:
+            _write_query_log_now(log_data)
+            logger.info(f"Query log written to {QUERY_LOG_FILE} (writer queue full)")
+        return f"Query log saved successfully to {QUERY_LOG_FILE}"
     except Exception as e:
         logger.error(f"Error saving query log: {str(e)}", exc_info=True)
         return f"Error saving query log: {str(e)}"
 
+def _format_log_summary(log_data, source):
+    """Format the summary of one query log record."""
+    # Extract key information
+    timestamp = log_data.get('timestamp', 'Unknown')
+    nl_query = log_data.get('natural_language_query', 'Unknown')
+    sql_query = log_data.get('final_sql_query', 'Unknown')
+    success = log_data.get('result', {}).get('success', False)
+    
+    # Count iterations
+    iterations = log_data.get('iterations', [])
+    iteration_count = len(iterations)
+    
+    # Format a summary
+    status = "✅ Success" if success else "❌ Failed"
+    log_summary = f"[{timestamp}] {status}\n"
+    log_summary += f"Natural language: {nl_query[:100]}{'...' if len(nl_query) > 100 else ''}\n"
+    log_summary += f"SQL: {sql_query[:100]}{'...' if len(sql_query) > 100 else ''}\n"
+    log_summary += f"Iterations: {iteration_count}\n"
+    log_summary += f"Log file: {source}\n"
+    return log_summary
+
+@lru_cache(maxsize=1024)
+def _summarize_log(path, mtime_ns, size):
+    """Format the summary of one per-query JSON log file (the pre-JSONL format).
+    
+    Cached on (path, mtime, size): log files are written once, so a repeat
+    call only parses files that are new or changed.
+    """
+    with open(path, 'r') as f:
+        return _format_log_summary(json.load(f), os.path.basename(path))
+
+def read_last_lines(path, n, block_size=1 << 16):
+    """Return up to the last n non-empty lines of a file, newest first.
+    
+    The file is read backwards in blocks, so earlier records are never read.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b""
+        # n + 1 newlines guarantee the last n lines are complete
+        while position > 0 and data.count(b"\n") <= n:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    return lines[::-1][:n]
+
 @mcp.tool()
 def get_recent_query_logs(num_logs: int = 5) -> str:
     """Retrieve the most recent query logs.
@@ -871,50 +1615,37 @@ def get_recent_query_logs(num_logs: int = 5) -> str:
     logger.info(f"Retrieving {num_logs} most recent query logs")
     
     try:
-        log_dir = "logs/queries"
-        if not os.path.exists(log_dir):
+        if not os.path.exists(QUERY_LOG_DIR):
             return "No query logs found. The logs directory doesn't exist yet."
         
-        # Get all log files sorted by modification time (newest first)
-        log_files = sorted(
-            [os.path.join(log_dir, f) for f in os.listdir(log_dir) if f.endswith('.json')],
-            key=os.path.getmtime,
-            reverse=True
-        )
+        results = []
         
-        if not log_files:
-            return "No query logs found in the logs directory."
+        # Newest records are at the end of the JSONL log
+        if os.path.exists(QUERY_LOG_FILE):
+            source = os.path.basename(QUERY_LOG_FILE)
+            for line in read_last_lines(QUERY_LOG_FILE, num_logs):
+                try:
+                    results.append(_format_log_summary(json.loads(line), source))
+                except Exception as e:
+                    results.append(f"Error parsing log record in {source}: {str(e)}")
         
-        # Limit to requested number
-        log_files = log_files[:num_logs]
+        # Fill up from per-query JSON files written before the JSONL log, newest first;
+        # scandir returns the stat info with the listing
+        if len(results) < num_logs:
+            log_entries = sorted(
+                (entry for entry in os.scandir(QUERY_LOG_DIR) if entry.name.endswith('.json')),
+                key=lambda entry: entry.stat().st_mtime_ns,
+                reverse=True
+            )
+            for entry in log_entries[:num_logs - len(results)]:
+                try:
+                    stat = entry.stat()
+                    results.append(_summarize_log(entry.path, stat.st_mtime_ns, stat.st_size))
+                except Exception as e:
+                    results.append(f"Error parsing log file {entry.name}: {str(e)}")
         
-        results = []
-        for log_file in log_files:
-            try:
-                with open(log_file, 'r') as f:
-                    log_data = json.load(f)
-                
-                # Extract key information
-                timestamp = log_data.get('timestamp', 'Unknown')
-                nl_query = log_data.get('natural_language_query', 'Unknown')
-                sql_query = log_data.get('final_sql_query', 'Unknown')
-                success = log_data.get('result', {}).get('success', False)
-                
-                # Count iterations
-                iterations = log_data.get('iterations', [])
-                iteration_count = len(iterations)
-                
-                # Format a summary
-                status = "✅ Success" if success else "❌ Failed"
-                log_summary = f"[{timestamp}] {status}\n"
-                log_summary += f"Natural language: {nl_query[:100]}{'...' if len(nl_query) > 100 else ''}\n"
-                log_summary += f"SQL: {sql_query[:100]}{'...' if len(sql_query) > 100 else ''}\n"
-                log_summary += f"Iterations: {iteration_count}\n"
-                log_summary += f"Log file: {os.path.basename(log_file)}\n"
-                
-                results.append(log_summary)
-            except Exception as e:
-                results.append(f"Error parsing log file {os.path.basename(log_file)}: {str(e)}")
+        if not results:
+            return "No query logs found in the logs directory."
         
         return "\n\n".join(results)
     except Exception as e:
@@ -0,0 +1,85 @@
+"""Tests for the query_table table-access check in mcp-ssms-server.py."""
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+
+# The server imports these at module level
+for module in ("pyodbc", "loguru", "mcp", "dotenv", "tabulate"):
+    pytest.importorskip(module)
+
+os.environ["MSSQL_DATABASE"] = "Sales"
+os.environ["MSSQL_TABLE_SCHEMA"] = "dbo"
+os.environ["MSSQL_TABLE_NAME"] = "Orders"
+
+_spec = importlib.util.spec_from_file_location(
+    "mcp_ssms_server", Path(__file__).resolve().parent.parent / "mcp-ssms-server.py"
+)
+server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(server)
+
+
+def disallowed(sql):
+    return server.analyze_sql(sql)[1]
+
+
+@pytest.mark.parametrize("sql", [
+    # Dynamic SQL hides the table in a string literal
+    "EXEC('SELECT * FROM Secrets')",
+    "EXEC sp_executesql N'SELECT * FROM Secrets'",
+    "DECLARE @s nvarchar(100) = 'SELECT * FROM Secrets'; EXEC(@s)",
+    "SELECT * FROM OPENROWSET('SQLNCLI', 'Server=x', 'SELECT * FROM Secrets')",
+    # Comma-joined tables after table hints, aliases or ON conditions
+    "SELECT * FROM Orders WITH (NOLOCK), Secrets",
+    "SELECT * FROM Orders o WITH (NOLOCK), Secrets",
+    "SELECT * FROM Orders TABLESAMPLE (10 PERCENT), Secrets",
+    "SELECT * FROM Orders (NOLOCK), Secrets",
+    "SELECT * FROM Orders o JOIN Orders p ON o.id = p.id, Secrets",
+    # A CTE only shadows tables inside its own statement
+    "SELECT * FROM Secrets; WITH Secrets AS (SELECT 1 AS x) SELECT * FROM Secrets",
+    "WITH Secrets AS (SELECT 1 AS x) SELECT * FROM Secrets SELECT * FROM Secrets",
+    # DELETE, INSERT and MERGE without FROM/INTO
+    "DELETE Secrets WHERE id = 1",
+    "INSERT Secrets VALUES (1)",
+    "MERGE Secrets AS t USING Orders s ON t.id = s.id WHEN MATCHED THEN DELETE;",
+    # The configured table in another database or on a linked server
+    "SELECT * FROM otherdb.dbo.Orders",
+    "SELECT * FROM srv.otherdb.dbo.Orders",
+    # DDL on other tables
+    "TRUNCATE TABLE Secrets",
+    "DROP TABLE IF EXISTS Orders, Secrets",
+    "ALTER TABLE Secrets ADD x int",
+    # Temporal clauses and APPLY
+    "SELECT * FROM Orders FOR SYSTEM_TIME ALL, Secrets",
+    "SELECT * FROM Orders o CROSS APPLY dbo.AnyTVF(o.id)",
+    "SELECT TRIM(' ' FROM name), (SELECT TOP 1 a FROM Secrets) FROM Orders",
+])
+def test_rejects_other_tables(sql):
+    assert disallowed(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM Orders",
+    "SELECT a, b FROM dbo.Orders o WITH (NOLOCK) WHERE a IN (1, 2) ORDER BY a, b",
+    "SELECT * FROM Orders TABLESAMPLE (10 PERCENT) o WITH (NOLOCK)",
+    "SELECT * FROM Orders a, Orders b WHERE a.id = b.id",
+    "SELECT * FROM Orders WHERE note = 'EXEC SELECT * FROM Secrets'",
+    "WITH c AS (SELECT * FROM Orders), d (y) AS (SELECT a FROM c) SELECT * FROM c, d",
+    "WITH c AS (SELECT a FROM Orders) INSERT INTO Orders (a) SELECT a FROM c",
+    "UPDATE o SET a = 1 FROM dbo.Orders o",
+    "DELETE TOP (5) FROM Orders",
+    "MERGE INTO Orders AS t USING Orders AS s ON t.id = s.id "
+    "WHEN MATCHED THEN UPDATE SET a = s.a WHEN NOT MATCHED BY SOURCE THEN DELETE;",
+    "MERGE Orders AS t USING Orders s ON t.id = s.id WHEN NOT MATCHED THEN INSERT VALUES (s.a);",
+    "SELECT * FROM Sales.dbo.Orders",
+    "INSERT Orders VALUES (1)",
+    "TRUNCATE TABLE #t",
+    "SELECT TRIM(' ' FROM name) FROM Orders",
+    "SELECT * FROM Orders WHERE a IS DISTINCT FROM b",
+    "SELECT * FROM Orders WHERE a IS NOT DISTINCT FROM b",
+    "SELECT * FROM Orders FOR SYSTEM_TIME FROM '2020-01-01' TO '2021-01-01' AS o",
+    "SELECT * FROM Orders o CROSS APPLY (SELECT TOP 1 * FROM Orders p WHERE p.id = o.id) x",
+])
+def test_allows_configured_table(sql):
+    assert disallowed(sql) == ()